@@ -1,8 +1,60 @@
-from .gdst import read_bin, read_bin_multiple_chn
-from .gdst import bheader_decode
+from .gdst import read_bin, read_bin_multiple_chn, MappedBlocks, read_window, prefetch_bins, BinFollower
+from .gdst import bheader_decode, bheader_decode_all, block_health, fill_empty_block
+from .gdst import bheader_table, bheader_time_index, time_to_sample, BHEADER_TABLE_DTYPE
+from .gdst import read_bheaders
 
-from .convert import bins2sac, bins2sac_Z
-from .convert import bins2h5, bins2h5_day
-from .convert import bheader2csv, bheader2list, bheader_list2csv
+from .filters import decimate, resample, decimation_sos, decimation_zi
 
-from .example import test
\ No newline at end of file
+from .qc import qc_stats, qc_freq_bins
+
+from .catalog import build_catalog, load_catalog, save_catalog
+from .catalog import catalog_select, catalog_paths, catalog_stations
+
+from .synth import make_bin, make_survey
+
+from .scan import scan_bin, scan_stations, scan_survey, scan2csv, SCAN_DTYPE, STATION_SCAN_DTYPE
+
+from .shared import SharedArray, read_array_window, read_h5_array_window
+
+from .monitor import ConvertStats
+
+from .cache import BinCache, enable_bin_cache, disable_bin_cache
+
+# 以下函数依赖 obspy, h5py 或 matplotlib, 第一次访问时才导入对应的模块,
+# 只读取BIN文件(read_bin等)时不加载这些依赖
+_LAZY = {
+    'bins2sac'        : 'convert',
+    'bins2sac_Z'      : 'convert',
+    'SacWriter'       : 'convert',
+    'bins2h5'         : 'convert',
+    'bins2h5_day'     : 'convert',
+    'bins2npy_day'    : 'convert',
+    'load_npy_day'    : 'convert',
+    'follow2h5'       : 'convert',
+    'h5_virtual'      : 'convert',
+    'station_day'     : 'convert',
+    'file_provenance' : 'convert',
+    'h5_storage'      : 'convert',
+    'bheader2csv'     : 'convert',
+    'bheader2list'    : 'convert',
+    'bheader_list2csv': 'convert',
+    'bheader_table2csv': 'convert',
+
+    'test'            : 'example',
+}
+
+
+__all__ = [name for name in globals() if not name.startswith('_')]+list(_LAZY.keys())
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        from importlib import import_module
+        value = getattr(import_module(f'.{_LAZY[name]}', __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(list(globals().keys())+list(_LAZY.keys()))
@@ -0,0 +1,139 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+# 解码后的小时文件的LRU缓存, 用于交互式或重复读取同一文件; 默认关闭, 见 enable_bin_cache
+
+
+class BinCache:
+    '''
+    read_bin / read_bin_multiple_chn 结果的LRU缓存, 总字节数不超过max_bytes,
+    键为 (文件路径, 修改时间, 大小) 及影响结果的读取参数(DB, dtype 等), 文件被改写后自动失效
+
+    缓存的数组为只读(writeable=False), 多个调用方共享同一份数据; 需要修改时先复制
+    线程安全, 可在线程池中使用
+
+    max_bytes: 缓存的总字节数上限, 单个超过上限的结果不缓存
+
+    eg:
+        cache = enable_bin_cache(2*2**30)       # 之后所有 read_bin 调用使用该缓存
+        H, data, hs = read_bin(file, dt=2)
+        cache.stats()                           # {'hits':, 'misses':, 'evictions':, 'entries':, 'nbytes':, ...}
+
+        read_bin(file, dt=2, cache=BinCache(2**30))   # 或者只对部分调用使用单独的缓存
+    '''
+
+    def __init__(self, max_bytes=2**30):
+        self.max_bytes = int(max_bytes)
+        self.entries   = OrderedDict()
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.lock      = threading.Lock()
+
+    @staticmethod
+    def key(file_name, *args) -> tuple:
+        '''
+        缓存键: (绝对路径, 修改时间ns, 大小, *args)
+        '''
+        st = os.stat(file_name)
+        return (os.path.realpath(file_name), st.st_mtime_ns, st.st_size)+args
+
+    def get(self, key):
+        '''
+        命中时返回缓存的结果并标记为最近使用, 否则返回None
+        '''
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def put(self, key, value:tuple) -> tuple:
+        '''
+        缓存一个结果(数组的tuple), 数组设为只读; 超出max_bytes时淘汰最久未使用的结果
+
+        out: value
+        '''
+        nbytes = 0
+        for a in value:
+            if isinstance(a, np.ndarray):
+                a.setflags(write=False)
+                nbytes += a.nbytes
+        if nbytes>self.max_bytes:
+            return value
+
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            self._evict(self.max_bytes-nbytes)
+            self.entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+        return value
+
+    def _evict(self, max_bytes):
+        # 淘汰最久未使用的结果, 直到占用不超过max_bytes; 调用时持有lock
+        while self.entries and self.nbytes>max_bytes:
+            _, (_, n) = self.entries.popitem(last=False)
+            self.nbytes -= n
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        '''
+        命中/未命中/淘汰次数及当前占用
+        '''
+        with self.lock:
+            n = self.hits+self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits/n if n else 0.0,
+                    'entries': len(self.entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# read_bin 等在 cache=None 时使用的全局缓存
+_DEFAULT = None
+
+
+def enable_bin_cache(max_bytes=2**30) -> BinCache:
+    '''
+    打开全局缓存, 之后 read_bin / read_bin_multiple_chn 默认使用; 已打开时只修改上限
+    '''
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = BinCache(max_bytes)
+    else:
+        with _DEFAULT.lock:
+            _DEFAULT.max_bytes = int(max_bytes)
+            _DEFAULT._evict(_DEFAULT.max_bytes)
+    return _DEFAULT
+
+
+def disable_bin_cache():
+    '''
+    关闭并清空全局缓存
+    '''
+    global _DEFAULT
+    if _DEFAULT is not None:
+        _DEFAULT.clear()
+    _DEFAULT = None
+
+
+def bin_cache(cache=None):
+    '''
+    cache: None 为全局缓存(未打开时为None), False 为不使用缓存, 或 BinCache
+    '''
+    if cache is None:
+        return _DEFAULT
+    return None if cache is False else cache
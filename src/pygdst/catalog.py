@@ -0,0 +1,163 @@
+import os
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .gdst import read_header
+from .paras import FHEADER_DEF, BLOCK_SIZE
+
+# 原始文件名 YYMMDDHH.BIN
+BIN_PATTERN = re.compile(r'^(\d{6})(\d{2})\.BIN$')
+
+# 目录下每个文件一条记录
+CATALOG_DTYPE = np.dtype([
+    ('sn',    'S32'),
+    ('date',  'S6'),
+    ('hour',  'u1'),
+    ('size',  'i8'),
+    ('mtime', 'f8'),
+    ('n_chn', 'i2'),
+]+[(key, 'i4') for key in FHEADER_DEF.keys()])
+
+# 每个台站文件夹一条记录, 用于增量更新
+DIR_DTYPE = np.dtype([
+    ('sn',    'S32'),
+    ('mtime', 'f8'),
+])
+
+
+def _scan_station(ROOT_folder, sn, dt, old_records):
+    '''
+    扫描一个台站文件夹, 大小和修改时间未变化的文件沿用old_records, 不重新读取头文件
+    '''
+    old = {(r['date'], r['hour']): r for r in old_records}
+    path_sn = f'{ROOT_folder}/{sn}'
+    N_DATA = int(7200/(dt*1000))
+
+    records = []
+    with os.scandir(path_sn) as it:
+        for entry in it:
+            m = BIN_PATTERN.match(entry.name)
+            if m is None or not entry.is_file():
+                continue
+            st = entry.stat()
+            key = (m.group(1).encode(), int(m.group(2)))
+            r = old.get(key)
+            if r is not None and r['size']==st.st_size and r['mtime']==st.st_mtime:
+                records.append(r)
+                continue
+
+            r = np.zeros((), dtype=CATALOG_DTYPE)
+            r['sn'], r['date'], r['hour'] = sn, key[0], key[1]
+            r['size'], r['mtime'] = st.st_size, st.st_mtime
+            r['n_chn'] = st.st_size//(BLOCK_SIZE*4)//N_DATA
+            header = read_header(entry.path)
+            for name, i in FHEADER_DEF.items():
+                if i<len(header):
+                    r[name] = header[i]
+            records.append(r)
+
+    return np.array(records, dtype=CATALOG_DTYPE)
+
+
+def build_catalog(ROOT_folder, index_file=None, dt=0.002, workers=8, dir_mtime=False) -> dict:
+    '''
+    扫描原始文件根目录 ROOT_folder/{sn}/{date}{hour}.BIN, 建立文件目录(catalog)
+
+    ROOT_folder: 原始文件根目录
+    index_file : 索引文件(.npz), 存在时增量更新: 每个台站文件夹都列目录并取得各文件的大小和修改时间,
+                 只有大小和修改时间未变化的文件不再读取头文件; 结果写回index_file
+    dt         : 采样间隔, 单位s, 用于计算通道数
+    workers    : 扫描台站文件夹的线程数
+    dir_mtime  : 修改时间未变化的台站文件夹不再列目录, 直接沿用索引中的记录; 原地改写或追加写入的文件
+                 不改变文件夹的修改时间, 此时目录中的大小和修改时间可能过期, 不能用于续写时判断文件是否变化
+
+    out: {'root': ROOT_folder, 'files': CATALOG_DTYPE数组, 'dirs': DIR_DTYPE数组}
+    '''
+    old_files = np.zeros(0, dtype=CATALOG_DTYPE)
+    old_dirs  = {}
+    if index_file is not None and os.path.exists(index_file):
+        old = load_catalog(index_file)
+        if old['root']==ROOT_folder:
+            old_files = old['files']
+            old_dirs  = {r['sn'].decode(): r['mtime'] for r in old['dirs']}
+
+    dirs = []
+    with os.scandir(f'{ROOT_folder}/') as it:
+        for entry in it:
+            if entry.is_dir():
+                dirs.append((entry.name, entry.stat().st_mtime))
+    dirs.sort()
+
+    def scan(item):
+        sn, mtime = item
+        old_records = old_files[old_files['sn']==sn.encode()]
+        if dir_mtime and old_dirs.get(sn)==mtime:
+            return old_records
+        return _scan_station(ROOT_folder, sn, dt, old_records)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = list(pool.map(scan, dirs))
+
+    files = np.concatenate(files) if len(files) else np.zeros(0, dtype=CATALOG_DTYPE)
+    files = np.sort(files, order=['sn', 'date', 'hour'])
+    catalog = {
+        'root' : ROOT_folder,
+        'files': files,
+        'dirs' : np.array(dirs, dtype=DIR_DTYPE),
+    }
+
+    if index_file is not None:
+        save_catalog(catalog, index_file)
+    return catalog
+
+
+def save_catalog(catalog:dict, index_file):
+    '''
+    保存为压缩的npz索引文件
+    '''
+    with open(index_file, 'wb') as f:
+        np.savez_compressed(f, root=np.array(catalog['root']), files=catalog['files'], dirs=catalog['dirs'])
+
+
+def load_catalog(index_file) -> dict:
+    '''
+    读取build_catalog保存的索引文件
+    '''
+    with np.load(index_file) as f:
+        return {'root': str(f['root']), 'files': f['files'], 'dirs': f['dirs']}
+
+
+def catalog_select(catalog:dict, sn=None, date=None) -> np.array:
+    '''
+    按台站和日期筛选记录
+
+    sn   : 仪器号, str 或 None(全部)
+    date : 日期 YYMMDD, str 或 None(全部)
+    '''
+    files = catalog['files']
+    mask = np.ones(len(files), dtype=bool)
+    if sn is not None:
+        mask &= files['sn']==str(sn).encode()
+    if date is not None:
+        mask &= files['date']==str(date).encode()
+    return files[mask]
+
+
+def catalog_paths(catalog:dict, sn=None, date=None) -> list:
+    '''
+    按台站和日期筛选的文件名 list, 可直接用于 bins2sac / bins2h5
+
+    eg: bins2sac(catalog_paths(catalog, sn='A0000102', date='240528'), ...)
+    '''
+    root = catalog['root']
+    return [f"{root}/{r['sn'].decode()}/{r['date'].decode()}{r['hour']:02d}.BIN"
+            for r in catalog_select(catalog, sn=sn, date=date)]
+
+
+def catalog_stations(catalog:dict, date=None) -> list:
+    '''
+    有记录的仪器号 list, 按名称排序
+    '''
+    files = catalog_select(catalog, date=date)
+    return [sn.decode() for sn in np.unique(files['sn'])]
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing as mp
+
+from .catalog import build_catalog, catalog_paths, catalog_stations
+from .monitor import ConvertStats
+
+# 命令行入口: pygdst convert-survey ROOT --dates 240528 240529 --format h5
+#             pygdst scan ROOT --out ./report
+# 每个任务(h5: 一天; sac: 一个台站一天)在独立的进程中运行, 结果记录在manifest中, 重新运行时跳过已完成的任务
+
+DONE, FAILED, TIMEOUT = 'done', 'failed', 'timeout'
+
+
+def survey_jobs(catalog:dict, out, dates=None, fmt='h5') -> list:
+    '''
+    按日期(h5)或台站+日期(sac)划分任务
+
+    catalog: build_catalog 生成的文件目录
+    out    : 输出文件夹
+    dates  : 日期 YYMMDD list, None 为 catalog 中的全部日期
+    fmt    : 'h5' 每天一个 bins2h5_day 任务; 'sac' 每个台站每天一个 bins2sac 任务
+
+    out: [{'id':, 'format':, 'date':, 'sn':, 'output':}, ...]
+    '''
+    if dates is None:
+        dates = sorted(set(d.decode() for d in catalog['files']['date']))
+
+    jobs = []
+    for date in dates:
+        if fmt=='h5':
+            jobs.append({'id': f'h5/{date}', 'format': fmt, 'date': date, 'sn': None,
+                         'output': f'{out}/{date}.h5'})
+        else:
+            for sn in catalog_stations(catalog, date=date):
+                jobs.append({'id': f'sac/{date}/{sn}', 'format': fmt, 'date': date, 'sn': sn,
+                             'output': f'{out}/{date}/{sn}.{{CHN}}.sac'})
+    return jobs
+
+
+def load_manifest(manifest_file) -> dict:
+    if manifest_file is None or not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest:dict, manifest_file):
+    # 先写临时文件再替换, 中断时不会留下不完整的manifest
+    tmp = f'{manifest_file}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, manifest_file)
+
+
+def run_job(job:dict, catalog:dict, opts:dict) -> dict:
+    '''
+    运行一个任务, 返回 ConvertStats.summary()
+    '''
+    # 在子进程中导入, 主进程不需要obspy和h5py
+    from .convert import bins2h5_day, bins2sac
+    from .paras import CHN_DEF
+
+    stats = ConvertStats()
+    date, sn = job['date'], job['sn']
+    header_dir = f"{opts['out']}/headers" if opts['headers'] else None
+    if header_dir is not None:
+        os.makedirs(header_dir, exist_ok=True)
+
+    if job['format']=='h5':
+        os.makedirs(os.path.dirname(job['output']) or '.', exist_ok=True)
+        bins2h5_day(catalog['root'], job['output'], date,
+                    header_file_pattern=None if header_dir is None else f'{header_dir}/{{date}}_{{name}}.csv',
+                    N_CHN=opts['N_CHN'], DB=opts['DB'], dt=opts['dt'], DOWNSAMPLE_RATE=opts['downsample'],
+                    workers=opts['job_workers'], catalog=catalog, raw_counts=opts['raw_counts'],
+                    compression=opts['compression'], shuffle=opts['compression'] is not None,
+                    chunk_seconds=opts['chunk_seconds'], stats=stats, qc=opts['qc'])
+    else:
+        os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+        sac_file = job['output'] if opts['N_CHN']>1 else job['output'].format(CHN=CHN_DEF[1])
+        bins2sac(catalog_paths(catalog, sn=sn, date=date), sac_file, dt=opts['dt'], name=sn,
+                 DB=opts['DB'], N_CHN=opts['N_CHN'], DOWNSAMPLE_RATE=opts['downsample'],
+                 header_file=None if header_dir is None else f'{header_dir}/{date}_{sn}.csv', stats=stats,
+                 qc=opts['qc'], qc_file=None if opts['qc'] is None else f"{opts['out']}/{date}/{sn}.qc.npz")
+    return stats.summary()
+
+
+def _job_process(job, catalog, opts, conn):
+    try:
+        conn.send((DONE, run_job(job, catalog, opts)))
+    except BaseException:
+        conn.send((FAILED, traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_jobs(jobs:list, catalog:dict, opts:dict, manifest_file=None, workers=1, timeout=None, force=False) -> dict:
+    '''
+    在进程池中运行任务, 同时运行的进程不超过workers个; 超过timeout(s)的任务被终止
+
+    manifest_file: 任务记录(json), 每个任务结束后更新; 已完成(done)的任务跳过,
+                   failed/timeout 的任务重新运行
+    force        : 忽略manifest, 全部重新运行
+
+    out: manifest, {job_id: {'status':, 'time':, 'output':, 'error' 或 'stats':}}
+    '''
+    manifest = {} if force else load_manifest(manifest_file)
+    todo = [job for job in jobs if manifest.get(job['id'], {}).get('status')!=DONE]
+    print(f'{len(jobs)-len(todo)} jobs done, {len(todo)} to run, {workers} workers', flush=True)
+
+    def finish(job, status, t0, info):
+        record = {'status': status, 'time': time.time()-t0, 'output': job['output']}
+        record['stats' if status==DONE else 'error'] = info
+        manifest[job['id']] = record
+        if manifest_file is not None:
+            save_manifest(manifest, manifest_file)
+        print(f"{status:8s} {job['id']} {record['time']:.1f}s", flush=True)
+
+    # 不使用daemon进程, 任务内部可再开进程池(bins2h5_day workers)
+    running = []
+    todo = todo[::-1]
+    while todo or running:
+        while todo and len(running)<workers:
+            job = todo.pop()
+            parent, child = mp.Pipe(duplex=False)
+            p = mp.Process(target=_job_process, args=(job, catalog, opts, child))
+            p.start()
+            child.close()
+            running.append((job, p, parent, time.time()))
+
+        still = []
+        for job, p, conn, t0 in running:
+            if conn.poll():
+                try:
+                    status, info = conn.recv()
+                except EOFError:
+                    status, info = FAILED, 'worker exited without result'
+                p.join()
+                finish(job, status, t0, info)
+            elif not p.is_alive():
+                p.join()
+                finish(job, FAILED, t0, f'worker exited with code {p.exitcode}')
+            elif timeout is not None and time.time()-t0>timeout:
+                p.kill()
+                p.join()
+                finish(job, TIMEOUT, t0, f'killed after {timeout}s')
+            else:
+                still.append((job, p, conn, t0))
+        running = still
+        if running:
+            time.sleep(0.1)
+
+    return manifest
+
+
+def convert_survey(args):
+    catalog = build_catalog(args.ROOT, index_file=args.catalog, dt=args.dt, workers=args.scan_workers)
+    jobs = survey_jobs(catalog, args.out, dates=args.dates, fmt=args.format)
+    opts = {
+        'out'          : args.out,
+        'N_CHN'        : args.N_CHN,
+        'DB'           : args.DB,
+        'dt'           : args.dt,
+        'downsample'   : args.downsample,
+        'job_workers'  : args.job_workers,
+        'raw_counts'   : args.raw_counts,
+        'compression'  : args.compression,
+        'chunk_seconds': args.chunk_seconds,
+        'headers'      : not args.no_headers,
+        'qc'           : args.qc,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    manifest_file = args.manifest if args.manifest is not None else f'{args.out}/manifest.json'
+    manifest = run_jobs(jobs, catalog, opts, manifest_file=manifest_file, workers=args.workers,
+                        timeout=args.timeout, force=args.force)
+
+    status = [manifest[job['id']]['status'] for job in jobs]
+    print(f"{status.count(DONE)} done, {status.count(FAILED)} failed, {status.count(TIMEOUT)} timeout")
+    return 0 if status.count(DONE)==len(jobs) else 1
+
+
+def scan(args):
+    from .scan import scan_survey, scan2csv
+
+    catalog = build_catalog(args.ROOT, index_file=args.catalog, dt=args.dt, workers=args.workers)
+    report = scan_survey(args.ROOT, dt=args.dt, step=args.step, workers=args.workers,
+                         catalog=catalog, dates=args.dates)
+    print(f"{'sn':12s} {'files':>5s} {'lat':>10s} {'lon':>11s} {'lock':>6s} {'gaps':>5s}  first - last")
+    for r in report['stations']:
+        print(f"{r['sn'].decode():12s} {r['n_files']:5d} {r['lat']:10.5f} {r['lon']:11.5f} "
+              f"{r['lock']:6.1%} {r['seq_gaps']:5d}  {r['t_first']} - {r['t_last']}")
+    if args.out is not None:
+        os.makedirs(args.out, exist_ok=True)
+        scan2csv(report['stations'], f'{args.out}/stations.csv')
+        scan2csv(report['files'], f'{args.out}/files.csv')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pygdst')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('convert-survey', help='转换整个测线的原始文件 ROOT/{sn}/{date}{hour}.BIN')
+    p.add_argument('ROOT', help='原始文件根目录')
+    p.add_argument('--dates', nargs='+', default=None, help='日期 YYMMDD, 默认为全部日期')
+    p.add_argument('--format', choices=['h5', 'sac'], default='h5',
+                   help='h5: 每天一个bins2h5_day文件; sac: 每个台站每天一组sac文件')
+    p.add_argument('--out', default='./out', help='输出文件夹')
+    p.add_argument('--workers', type=int, default=os.cpu_count(), help='同时运行的任务数')
+    p.add_argument('--job-workers', type=int, default=1, help='每个h5任务内部的进程数')
+    p.add_argument('--timeout', type=float, default=None, help='单个任务的最长时间(s)')
+    p.add_argument('--manifest', default=None, help='任务记录, 默认为 {out}/manifest.json')
+    p.add_argument('--force', action='store_true', help='忽略任务记录, 全部重新转换')
+    p.add_argument('--catalog', default=None, help='文件目录索引(.npz), 增量扫描')
+    p.add_argument('--scan-workers', type=int, default=8, help='扫描目录的线程数')
+    p.add_argument('--N-CHN', dest='N_CHN', type=int, default=1, help='通道数')
+    p.add_argument('--DB', type=int, default=0, help='增益')
+    p.add_argument('--dt', type=float, default=0.002, help='采样间隔(s)')
+    p.add_argument('--downsample', type=int, default=5, help='降采样率')
+    p.add_argument('--raw-counts', action='store_true', help='h5保存为int32原始count')
+    p.add_argument('--compression', choices=['gzip', 'lzf'], default=None, help='h5压缩方式')
+    p.add_argument('--chunk-seconds', type=float, default=None, help='h5 chunk时长(s)')
+    p.add_argument('--no-headers', action='store_true', help='不输出头文件csv')
+    p.add_argument('--qc', choices=['raw', 'decimated'], default=None,
+                   help='转换时计算QC统计(每分钟RMS/最大值/削波数, 每小时PSD), 在降采前或降采后')
+    p.set_defaults(func=convert_survey)
+
+    p = sub.add_parser('scan', help='只读取数据块头文件, 统计各台站的位置、GPS锁定比例和首末时间')
+    p.add_argument('ROOT', help='原始文件根目录')
+    p.add_argument('--dates', nargs='+', default=None, help='日期 YYMMDD, 默认为全部日期')
+    p.add_argument('--out', default=None, help='输出文件夹, 写入 stations.csv 和 files.csv')
+    p.add_argument('--workers', type=int, default=16, help='线程数')
+    p.add_argument('--step', type=int, default=1, help='每隔step个数据块读取一个')
+    p.add_argument('--catalog', default=None, help='文件目录索引(.npz), 增量扫描')
+    p.add_argument('--dt', type=float, default=0.002, help='采样间隔(s)')
+    p.set_defaults(func=scan)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__=='__main__':
+    sys.exit(main())
@@ -1,18 +1,23 @@
-import obspy as ob
-from obspy.core.trace import Stats
-from obspy.core.utcdatetime import UTCDateTime
-from obspy import Stream, Trace
-
+# obspy 和 h5py 在用到的函数中导入, 只写sac或只写h5时不加载另一个
 import numpy as np
-import h5py
 from glob import glob
 import tqdm
-from scipy import signal
 import os
-
-from .gdst import read_bin
-from .gdst import  bheader_decode
-from .paras import DATA_SIZE,CHN_DEF
+import re
+import time
+from collections import deque
+from contextlib import ExitStack, closing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from .gdst import read_bin, prefetch_bins, BinFollower
+from .gdst import  bheader_decode_all, block_health
+from .gdst import BHEADER_TABLE_DTYPE, bheader_table, bheader_time_index
+from .filters import decimate, decimation_zi
+from .catalog import catalog_select, catalog_paths
+from .monitor import ConvertStats
+from .qc import qc_stats, qc_empty, qc_concatenate, QC_KEYS
+from .paras import DATA_SIZE,CHN_DEF, COUNT2V, DB_FACTOR, CLIP_LEVEL
 
 NETWORK = 'GDST'
 PATH_SEP = os.path.sep
@@ -31,12 +36,8 @@ def bheader2list(header, start=0, interval=60) -> list:
     out: a list of (date_UTC,time_UTC, lat, lon, seq1, seq2)
     '''
 
-    ns,nh = header.shape
-    inf_list = []
-    for i in range(start, ns, interval):
-        date_UTC,time_UTC, lat, lon, seq1, seq2 = bheader_decode(header[i,:])
-
-        inf_list.append([date_UTC,time_UTC, lat, lon, seq1, seq2])
+    columns = bheader_decode_all(header[start::interval,:])
+    inf_list = [list(line) for line in zip(*[c.tolist() for c in columns])]
 
     return inf_list
 
@@ -52,25 +53,40 @@ def bheader_list2csv(inf_list:list, file_name:str,M=',',REMOVE_ZERO=False, date=
     REMOVE_ZERO: 去除授时中的点
     date: 控制头文件不输出上一次采样结果
     '''
+    table = np.zeros(len(inf_list), dtype=BHEADER_TABLE_DTYPE)
+    if len(inf_list):
+        for name, column in zip(BHEADER_TABLE_DTYPE.names, zip(*inf_list)):
+            table[name] = column
+    return bheader_table2csv(table, file_name, M=M, REMOVE_ZERO=REMOVE_ZERO, date=date)
 
-    lines = []
-    lines.append( 'date_UTC,time_UTC,lat,lon,seq1,seq2,\n')
-    for date_UTC, time_UTC, lat, lon, seq1, seq2 in inf_list:
-
-        if REMOVE_ZERO and (lat==0 or lon==0):
-            continue
-        
-        if date is not None and date_UTC!=date:
-            continue
+def bheader_table2csv(table:np.array, file_name:str, M=',', REMOVE_ZERO=False, date=None):
+    '''
+    把块头表(bheader_table的输出)保存为csv, 格式与bheader_list2csv相同,
+    筛选和格式化一次完成, 一次写入
 
-        line_i = f'{date_UTC:06d}{M}{time_UTC:06d}{M}{lat:>2.7f}{M}{lon:>3.7f}{M}{seq1}{M}{seq2}{M}'
-    
-        lines.append(line_i+'\n')
+    table: BHEADER_TABLE_DTYPE 数组
+    file_name: 文件名
+    M: , for csv
+    REMOVE_ZERO: 去除授时中的点
+    date: 只输出该日期(YYMMDD)的记录
+    '''
+    table = table.reshape(-1)
+    keep = np.ones(len(table), dtype=bool)
+    if REMOVE_ZERO:
+        keep &= (table['lat']!=0) & (table['lon']!=0)
+    if date is not None:
+        keep &= table['date']==int(date)
+    table = table[keep]
+
+    rows = np.empty([len(table), len(BHEADER_TABLE_DTYPE.names)], dtype=object)
+    for j, name in enumerate(BHEADER_TABLE_DTYPE.names):
+        rows[:, j] = table[name].tolist()
+    line = M.join(['%06d', '%06d', '%2.7f', '%3.7f', '%d', '%d', ''])+'\n'
+
+    with open(file_name, 'w') as f:
+        f.write('date_UTC,time_UTC,lat,lon,seq1,seq2,\n')
+        f.write((line*len(table)) % tuple(rows.ravel().tolist()))
 
-    f = open(file_name,'w')
-    f.writelines(lines)
-    f.close()
-    
     return 1
 
 def bheader2csv(header, file_name, start=0, interval=60, REMOVE_ZERO=False):
@@ -80,12 +96,15 @@ def bheader2csv(header, file_name, start=0, interval=60, REMOVE_ZERO=False):
     header: np.array(int32), 2D
     file_name: csv 文件名
     '''
-    inf_lines = bheader2list(header, start=start, interval=interval)
-    return bheader_list2csv(inf_lines, file_name,M=',',REMOVE_ZERO=REMOVE_ZERO)
+    table = bheader_table(header[start::interval,:])
+    return bheader_table2csv(table, file_name,M=',',REMOVE_ZERO=REMOVE_ZERO)
     
 
-def create_sac_1h_1C(data:np.array, name:str,dt:float, time_s:str,  NET=NETWORK, CHN='Z')->ob.Trace:
-    
+def create_sac_1h_1C(data:np.array, name:str,dt:float, time_s:str,  NET=NETWORK, CHN='Z')->'obspy.Trace':
+    import obspy as ob
+    from obspy.core.trace import Stats
+    from obspy.core.utcdatetime import UTCDateTime
+
     stats = Stats()
     stats.network = NET
     stats.station = name
@@ -109,7 +128,236 @@ def create_sac_1h_1C(data:np.array, name:str,dt:float, time_s:str,  NET=NETWORK,
 
     return trace
 
-def bin2sac(bin_file:str,sac_file:str, time_s:str, dt:float,name:str, NET=NETWORK) -> any:
+# SAC头文件: 70个float32, 40个int32, 192字节字符, 共632字节
+SAC_HEADER_SIZE = 632
+SAC_UNDEF = -12345
+
+class SacWriter:
+    '''
+    流式写入单道SAC文件: 数据逐段追加到632字节之后, close时一次性写入头文件;
+    用作 with 语句时, 出错则删除文件(discard)
+
+    file_name : sac文件名
+    starttime : 第一个采样点的时间, UTCDateTime
+    dt        : 采样间隔, 单位s
+    name      : station name
+    CHN       : 通道名
+    NET       : network name
+    '''
+
+    def __init__(self, file_name, starttime:'UTCDateTime', dt:float, name:str, CHN='Z', NET=NETWORK):
+        self.starttime = starttime
+        self.dt   = dt
+        self.name = name
+        self.CHN  = CHN
+        self.NET  = NET
+
+        self.npts = 0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.vsum = 0.0
+
+        self.f = open(file_name, 'wb')
+        self.f.seek(SAC_HEADER_SIZE)
+
+    def write(self, data:np.array):
+        '''
+        追加采样点
+        '''
+        data = np.asarray(data, dtype='<f4')
+        if len(data)==0:
+            return
+        self.vmin = min(self.vmin, float(data.min()))
+        self.vmax = max(self.vmax, float(data.max()))
+        self.vsum += float(data.sum(dtype=np.float64))
+        self.npts += len(data)
+        data.tofile(self.f)
+
+    def write_zeros(self, npts:int):
+        '''
+        追加npts个0, 用于缺失的小时
+        '''
+        if npts<=0:
+            return
+        self.vmin = min(self.vmin, 0.0)
+        self.vmax = max(self.vmax, 0.0)
+        self.npts += npts
+        self.f.seek(npts*4, os.SEEK_CUR)
+        self.f.truncate()
+
+    def header(self) -> bytes:
+        '''
+        SAC头文件, 632字节
+        '''
+        hf = np.full(70, SAC_UNDEF, dtype='<f4')
+        hi = np.full(40, SAC_UNDEF, dtype='<i4')
+        hs = [b'-12345  ']*23
+
+        t = self.starttime
+        hf[0] = self.dt                               # delta
+        hf[1] = self.vmin if self.npts else 0         # depmin
+        hf[2] = self.vmax if self.npts else 0         # depmax
+        hf[3] = 1.0                                   # scale
+        hf[5] = 0.0                                   # b
+        hf[6] = (self.npts-1)*self.dt                 # e
+        hf[56] = self.vsum/self.npts if self.npts else 0 # depmen
+
+        hi[0:6] = [t.year, t.julday, t.hour, t.minute, t.second, t.microsecond//1000]
+        hi[6]  = 6          # nvhdr
+        hi[9]  = self.npts  # npts
+        hi[15] = 1          # iftype, ITIME
+        hi[17] = 9          # iztype, IB
+        hi[35:39] = [1, 1, 1, 0] # leven, lpspol, lovrok, lcalda
+
+        hs[0]  = self.name.encode()[:8].ljust(8)  # kstnm
+        hs[1]  = b'-12345  -12345  '              # kevnm, 16字节
+        hs[19] = self.CHN.encode()[:8].ljust(8)   # kcmpnm
+        hs[20] = self.NET.encode()[:8].ljust(8)   # knetwk
+
+        return hf.tobytes()+hi.tobytes()+b''.join(hs)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(self.header())
+        self.f.close()
+
+    def discard(self):
+        '''
+        关闭并删除未写完的文件
+        '''
+        self.f.close()
+        os.remove(self.f.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        # 正常结束时写入头文件, 出错时删除文件, 不留下头文件无效的SAC
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def bin_time(file:str, PATH_MARKER='/') -> 'UTCDateTime':
+    '''
+    由文件名 YYMMDDHH.BIN 得到该小时的开始时间
+    '''
+    from obspy.core.utcdatetime import UTCDateTime
+    t_s = file.split(PATH_MARKER)[-1][0:8]
+    return UTCDateTime(year=int(t_s[0:2])+2000, month=int(t_s[2:4]), day=int(t_s[4:6]), hour=int(t_s[6:8]))
+
+
+def _prefetch_timed(files, depth, stats, labels):
+    '''
+    prefetch_bins, 并把等待每个文件读完的时间记为 read 阶段: 预读时为未被计算掩盖的读取时间,
+    depth=0 时为读取本身; 之后 read_bin(raw=raw) 的解码由调用方记为 decode 阶段
+
+    labels: 每个文件的 (station, hour)
+    '''
+    reader = prefetch_bins(files, depth=depth)
+    try:
+        for station, hour in labels:
+            t = time.perf_counter()
+            file, raw = next(reader)
+            if raw is not None:
+                stats.add({'stage': 'read', 'station': station, 'hour': hour,
+                           'time': time.perf_counter()-t, 'bytes': raw.nbytes})
+            yield file, raw
+    finally:
+        reader.close()
+
+
+def _bins2sac_stream(bins_file:list, sac_files:list, chn_names:str, dt:float, name:str,
+                     DB=0, DOWNSAMPLE_RATE=1, NET=NETWORK, PATH_MARKER='/', HEALTH=True, stats=None,
+                     prefetch=2, qc=None) -> tuple:
+    '''
+    逐小时读取、按数据块健康度置零、降采样并直接写入各通道的SAC文件,
+    缺失的小时补0, 与 Stream.merge(fill_value=0)+decimate 结果相同;
+    每小时的采样点数不是DOWNSAMPLE_RATE的整数倍时, 各小时降采的起点随之错开(见decimate的phase);
+    此时每小时降采后的采样点数不同, 不能计算 qc='decimated'
+    后台预读之后的prefetch个文件; qc 见bins2sac
+
+    out: (所有数据块的块头表, BHEADER_TABLE_DTYPE (第0通道, 不含缺失的小时),
+          QC统计 dict (qc为None时为None), 缺失的小时为nan)
+    '''
+    if stats is None:
+        stats = ConvertStats()
+    N_CHN     = len(chn_names)
+    NT_ahour  = int(3600/dt)
+    if qc=='decimated' and NT_ahour%DOWNSAMPLE_RATE:
+        raise ValueError(f"qc='decimated' needs DOWNSAMPLE_RATE dividing {NT_ahour} samples per hour, "
+                         f"got {DOWNSAMPLE_RATE}")
+
+    t0 = bin_time(bins_file[0], PATH_MARKER)
+    zi = decimation_zi([N_CHN, NT_ahour], DOWNSAMPLE_RATE, dt)
+    zeros = None
+    assert qc in (None, 'raw', 'decimated')
+    dt_qc = dt if qc=='raw' else dt*DOWNSAMPLE_RATE
+    clip  = CLIP_LEVEL*2**31*COUNT2V*DB_FACTOR[DB]
+    qc_hours = []
+
+    tables = []
+    next_hour = 0
+    hours = [int(round((bin_time(file, PATH_MARKER)-t0)/3600)) for file in bins_file]
+    # 出错时关闭并删除已写了一部分的SAC文件(见SacWriter), 停止预读
+    with ExitStack() as stack:
+        writers = [stack.enter_context(SacWriter(sac_file_i, t0, dt*DOWNSAMPLE_RATE, name, CHN=chn_i, NET=NET))
+                   for sac_file_i, chn_i in zip(sac_files, chn_names)]
+        reader = stack.enter_context(closing(_prefetch_timed(bins_file, prefetch, stats,
+                                                             [(name, hour) for hour in hours])))
+        for hour, (file, raw) in zip(hours, reader):
+            assert hour>=next_hour
+
+            # 缺失的小时补0, 滤波器状态照常更新
+            for h in range(next_hour, hour):
+                stats.count('missing_minutes', 60, station=name)
+                if zeros is None:
+                    zeros = np.zeros([N_CHN, NT_ahour], dtype='float32')
+                with stats.stage('decimate', station=name, hour=h, nbytes=zeros.nbytes):
+                    data_DW, zi = decimate(zeros, DOWNSAMPLE_RATE, dt=dt, zi=zi, phase=-h*NT_ahour%DOWNSAMPLE_RATE)
+                with stats.stage('write', station=name, hour=h, nbytes=data_DW.nbytes):
+                    for j in range(N_CHN):
+                        if data_DW[j].any():
+                            writers[j].write(data_DW[j])
+                        else:
+                            writers[j].write_zeros(data_DW.shape[-1])
+                if qc is not None:
+                    qc_hours.append(qc_empty([N_CHN], 1, dt_qc))
+
+            with stats.stage('decode', station=name, hour=hour, nbytes=raw.nbytes):
+                # 逐个文件流式转换, 不使用缓存(数据会被原位置零)
+                H, data, hs = read_bin(file, dt=dt*1000,IS_Z_CHN=False, DB=DB, raw=raw, cache=False)
+            assert data.shape[0]==N_CHN
+
+            #头文件
+            with stats.stage('header', station=name, hour=hour, nbytes=hs.nbytes):
+                tables.append(bheader_table(hs[0,:,:]))
+                if HEALTH:
+                    t_s = file.split(PATH_MARKER)[-1][0:6]
+                    health_i = block_health(hs, dt=dt*1000, date=int(t_s))
+
+            #健康度, 按数据块
+            if HEALTH:
+                stats.count('unhealthy_minutes', float((~health_i.all(axis=0)).sum()*DATA_SIZE*dt/60), station=name)
+                with stats.stage('health', station=name, hour=hour, nbytes=data.nbytes):
+                    data.reshape([N_CHN, -1, DATA_SIZE])[~health_i] = 0
+
+            with stats.stage('decimate', station=name, hour=hour, nbytes=data.nbytes):
+                data_DW, zi = decimate(data, DOWNSAMPLE_RATE, dt=dt, zi=zi, phase=-hour*NT_ahour%DOWNSAMPLE_RATE)
+            if qc is not None:
+                data_qc = data if qc=='raw' else data_DW
+                with stats.stage('qc', station=name, hour=hour, nbytes=data_qc.nbytes):
+                    qc_hours.append(qc_stats(data_qc, dt_qc, clip=clip))
+            with stats.stage('write', station=name, hour=hour, nbytes=data_DW.nbytes):
+                for j in range(N_CHN):
+                    writers[j].write(data_DW[j])
+            next_hour = hour+1
+
+    table = np.concatenate(tables) if tables else np.zeros(0, dtype=BHEADER_TABLE_DTYPE)
+    return table, qc_concatenate(qc_hours) if qc_hours else None
+
+def bin2sac(bin_file:str,sac_file:str, time_s:str, dt:float,name:str, NET=NETWORK, stats=None) -> any:
     '''
     binary file to sac (1h)
 
@@ -120,27 +368,34 @@ def bin2sac(bin_file:str,sac_file:str, time_s:str, dt:float,name:str, NET=NETWOR
     
     name    : station name
     NET     : network name
+    stats   : ConvertStats, 分阶段计时
     '''
+    if stats is None:
+        stats = ConvertStats()
 
-    H, data, hs = read_bin(bin_file, dt=dt/1000)
+    with stats.stage('read', station=name, hour=time_s, nbytes=os.path.getsize(bin_file)):
+        H, data, hs = read_bin(bin_file, dt=dt/1000)
 
-    if data.shape[0]==1 and '{CHN}' not in sac_file:
-        trace = create_sac_1h_1C(data, name,dt, time_s,  NET=NETWORK,CHN='Z')
-        trace.write(sac_file)
+    with stats.stage('write', station=name, hour=time_s, nbytes=data.nbytes):
+        if data.shape[0]==1 and '{CHN}' not in sac_file:
+            trace = create_sac_1h_1C(data, name,dt, time_s,  NET=NETWORK,CHN='Z')
+            trace.write(sac_file)
 
-    else:
+        else:
 
-        nc = data.shape[0]
-        chn_names = CHN_DEF[nc]
-        for i, chn_i in enumerate(chn_names):
-            trace = create_sac_1h_1C(data[i,:], name,dt, time_s,  NET=NETWORK,CHN=chn_i)
-            sac_file_i = sac_file.format(CHN=chn_i)
-            trace.write(sac_file_i)
+            nc = data.shape[0]
+            chn_names = CHN_DEF[nc]
+            for i, chn_i in enumerate(chn_names):
+                trace = create_sac_1h_1C(data[i,:], name,dt, time_s,  NET=NETWORK,CHN=chn_i)
+                sac_file_i = sac_file.format(CHN=chn_i)
+                trace.write(sac_file_i)
         
 
-def bins2sac_Z(bins_file:list,sac_file:str, dt:float,name:str, DOWNSAMPLE_RATE=1, NET=NETWORK,PATH_MARKER='/') -> any:
+def bins2sac_Z(bins_file:list,sac_file:str, dt:float,name:str, DOWNSAMPLE_RATE=1, NET=NETWORK,PATH_MARKER='/',
+               stats=None, prefetch=2) -> any:
     '''
     merge binary files to a sac, 单通道 Z
+    逐小时写入, 缺失的小时补0
 
     bin_file        : file names of binary, list[str], eg: [./P320LINE/A0000102/24052808.BIN]
     sac_file        : file name of sac file
@@ -151,36 +406,21 @@ def bins2sac_Z(bins_file:list,sac_file:str, dt:float,name:str, DOWNSAMPLE_RATE=1
 
     NET     : network name
     PATH_MARKER: 路径分割符号
+    stats   : ConvertStats, 分阶段计时和缺失计数
+    prefetch: 后台预读的文件数, 0 为不预读
     '''
     bins_file.sort()
-    
-    traces=[]
-    for i, file in enumerate(bins_file):
 
-        t_string = file.split(PATH_MARKER)[-1]
-        t_s =  t_string[0:8]
-
-        H, data, hs = read_bin(file, dt=dt*1000,IS_Z_CHN=True)
-        # print(t_s,data.shape)
-        trace = create_sac_1h_1C(data, name,dt, t_s,  NET=NETWORK, CHN='Z')
-        traces.append(trace)
-
-    stream = ob.Stream(traces)
-    # print('1h',stream[0].data.shape)
-    stream = stream.merge(fill_value=0)
-    # print('after merge',stream[0].data.shape)
-
-    if DOWNSAMPLE_RATE>1:
-        
-        stream = stream.decimate(factor=DOWNSAMPLE_RATE)
-        # print('after DW',stream[0].data.shape)
-    stream.write(sac_file)
+    _bins2sac_stream(bins_file, [sac_file], 'Z', dt, name,
+                     DOWNSAMPLE_RATE=DOWNSAMPLE_RATE, NET=NET, PATH_MARKER=PATH_MARKER, HEALTH=False, stats=stats,
+                     prefetch=prefetch)
 
 def bins2sac(bins_file:list,sac_file:str,dt:float,name:str,
              DB=0,N_CHN=1, DOWNSAMPLE_RATE=1, NET=NETWORK,PATH_MARKER='/',
-             header_file=None) -> any:
+             header_file=None, stats=None, prefetch=2, header_table=None, qc=None, qc_file=None) -> any:
     '''
     merge binary files to a sac, 多通道
+    逐小时写入各通道的sac文件, 缺失的小时补0, 内存占用约为一小时数据
 
     bin_file        : file names of binary, list[str], eg: [./P320LINE/A0000102/24052808.BIN]
     sac_file        : sac文件名, use '{CHN}' as placeholder for 3C/4C sensor
@@ -193,126 +433,501 @@ def bins2sac(bins_file:list,sac_file:str,dt:float,name:str,
     
     NET     : network name
     PATH_MARKER: 路径分割符号
+    header_file: 头文件csv, 每分钟一条
+    header_table: 所有数据块的块头表(BHEADER_TABLE_DTYPE)保存为.npy文件
+    stats   : ConvertStats, 分阶段计时及缺失/不健康数据的计数
+    prefetch: 后台预读的文件数, 读取与降采样重叠; 0 为不预读
+    qc      : 转换时顺带计算QC统计(见qc_stats), 'raw' 在降采前, 'decimated' 在降采后, None 不计算
+    qc_file : QC统计保存为.npz (rms, max, clipped [N_CHN, n_minute], psd [N_CHN, n_hour, n_freq], freq, stage),
+              从第一个文件的小时开始, 缺失的小时为nan
     '''
     bins_file.sort()
+    assert (qc is None)==(qc_file is None)
     
     if N_CHN>1:
         assert '{CHN}' in sac_file
     if N_CHN==1 and '{CHN}' in sac_file:
         sac_file = sac_file.format(CHN='Z')
     
-    
-    traces    = [[]]*N_CHN
     chn_names = CHN_DEF[N_CHN]
+    if N_CHN>1:
+        sac_files = [sac_file.format(CHN=chn_i) for chn_i in chn_names]
+    else:
+        sac_files = [sac_file]
 
-    header_list = []
-    NT_amin   =  int(60/dt)
+    table, qc_i = _bins2sac_stream(bins_file, sac_files, chn_names, dt, name,
+                                   DB=DB, DOWNSAMPLE_RATE=DOWNSAMPLE_RATE, NET=NET, PATH_MARKER=PATH_MARKER,
+                                   stats=stats, prefetch=prefetch, qc=qc)
+    if qc_file is not None:
+        with open(qc_file, 'wb') as f:
+            np.savez(f, stage=qc, **qc_i)
 
-    for i, file in enumerate(bins_file):
+    # 写头文件
+    if header_file is not None:
+        bheader_table2csv(table[::int(60/dt/DATA_SIZE)],header_file, REMOVE_ZERO=False, date=None)
+    if header_table is not None:
+        np.save(header_table, table)
 
-        t_string = file.split(PATH_MARKER)[-1]
-        t_s =  t_string[0:8]
 
-        H, data, hs = read_bin(file, dt=dt*1000,IS_Z_CHN=False, DB=DB)
-        # print(t_s,data.shape)
-        assert data.shape[0]==N_CHN
-        # print(data.max())
-        #头文件
-        inf_lines = bheader2list(hs[0,:,:], start=0, interval=int(60/dt/DATA_SIZE))
-        header_list+=inf_lines
-
-        #健康度
-        health_i = np.ones([1,60,1])
-        health_i[0,:,0] = (np.array(inf_lines)[:,0]==int(t_s[:6]))
-        data = data.reshape([N_CHN, 60,NT_amin])*health_i
-        data = data.reshape([N_CHN,-1])
-        # print(data.max())
-        for j in range(N_CHN):
-            data_ij = data[j,:]
-            trace = create_sac_1h_1C(data_ij.flatten(), name,dt, t_s,  NET=NETWORK, CHN=chn_names[j])
-            traces[j].append(trace)
+def file_provenance(files:list, catalog=None) -> tuple:
+    '''
+    原始文件的来源信息, 用于判断输出是否过期
 
-    # 写头文件
-    if header_file is not None:
-        bheader_list2csv(header_list,header_file, REMOVE_ZERO=False, date=None)
-
-    for i in range(N_CHN):
-        stream = ob.Stream(traces[i])
-        # print('1h',stream[0].data.shape)
-        stream = stream.merge(fill_value=0)
-        # print('after merge',stream[0].data.shape)
-
-        if DOWNSAMPLE_RATE>1:
-            
-            stream = stream.decimate(factor=DOWNSAMPLE_RATE)
-            # print('after DW',stream[0].data.shape)
-        
-        if N_CHN>1:
-            sac_file_i = sac_file.format(CHN=chn_names[i])
+    files  : 文件名 list
+    catalog: build_catalog 生成的文件目录, 提供时直接使用其中的大小和修改时间, 不再stat
+
+    out: (文件名 S, 大小 int64, 修改时间 float64)
+    '''
+    known = {}
+    if catalog is not None:
+        sns = set(file.split('/')[-2] for file in files)
+        for sn in sns:
+            for file, r in zip(catalog_paths(catalog, sn=sn), catalog_select(catalog, sn=sn)):
+                known[file] = (r['size'], r['mtime'])
+
+    sizes  = []
+    mtimes = []
+    for file in files:
+        if file in known:
+            size, mtime = known[file]
         else:
-            sac_file_i = sac_file
+            st = os.stat(file)
+            size, mtime = st.st_size, st.st_mtime
+        sizes.append(size)
+        mtimes.append(mtime)
+    return np.array(files, dtype='S'), np.array(sizes, dtype='int64'), np.array(mtimes, dtype='float64')
 
-        stream.write(sac_file_i)
+def h5_storage(shape, dt, compression=None, compression_opts=None, shuffle=False, chunk_seconds=None) -> dict:
+    '''
+    h5 数据集的存储参数, 用于 create_dataset(**kwargs)
 
+    shape      : 数据集尺寸 [..., N_CHN, nt]
+    dt         : 采样间隔, 单位s
+    compression: None, 'gzip' 或 'lzf'
+    compression_opts: gzip 压缩等级 0-9
+    shuffle    : 压缩前按字节重排, 对int32/float32一般能明显提高压缩率
+    chunk_seconds: 每个chunk的时长(s), 每个chunk含全部通道, eg: 60 对应按分钟读取;
+                 None 则每个chunk为整段时间
 
-def bins2h5(bins_file:list, h5_name, dt=0.002, PATH_MARKER='/') -> any:
+    out: dict(chunks=..., compression=..., compression_opts=..., shuffle=...)
+    '''
+    nt = shape[-1]
+    if chunk_seconds is not None:
+        nt = min(nt, max(int(round(chunk_seconds/dt)), 1))
+    kwargs = {'chunks': (1,)*(len(shape)-2)+(shape[-2], nt)}
+
+    if compression is not None:
+        kwargs['compression'] = compression
+        if compression_opts is not None:
+            kwargs['compression_opts'] = compression_opts
+    if shuffle:
+        kwargs['shuffle'] = True
+    if compression is None and not shuffle and chunk_seconds is None and len(shape)==2:
+        kwargs = {} # 与之前一致, 连续存储
+
+    return kwargs
+
+def _to_counts_attrs(dataset, raw_counts, DB):
+    if raw_counts:
+        dataset.attrs['scale'] = COUNT2V*DB_FACTOR[DB]
+        dataset.attrs['units'] = 'count'
+
+def _replace_dataset(h5file, name, data):
+    if name in h5file:
+        del h5file[name]
+    h5file.create_dataset(name, data=data)
+
+
+def bins2h5(bins_file:list, h5_name, dt=0.002, PATH_MARKER='/', mode='w', catalog=None,
+            DB=0, raw_counts=False, compression=None, compression_opts=None, shuffle=False,
+            chunk_seconds=None, stats=None, prefetch=2) -> any:
     '''
-    把所有文件转成h5格式
+    把所有文件转成h5格式, 逐小时写入预先分配的数据集, 内存占用约为一小时数据
 
     bins_file: 文件名
     file_name: h5文件名
     dt       : 采样率
     PATH_MARKER: 路径分割符号
+    mode     : 'w' 重新生成; 'a' 追加/续写, 只转换新增的或大小、修改时间有变化的文件,
+               变化的文件原位覆盖, 新增的文件追加在末尾(以Times为准)
+    catalog  : build_catalog 生成的文件目录, 续写时用其中的大小和修改时间判断文件是否变化;
+               文件名可由 catalog_paths(catalog, sn, date) 得到
+    DB       : 增益率
+    raw_counts: data 保存为int32原始count, 属性 data.attrs['scale']=COUNT2V*DB_FACTOR[DB]
+    compression, compression_opts, shuffle, chunk_seconds: 存储参数, 见h5_storage
+    stats    : ConvertStats, 分阶段计时
+    prefetch : 后台预读的文件数, 读取与写入重叠; 0 为不预读
 
     '''
+    import h5py
+
     bins_file.sort()
+    if stats is None:
+        stats = ConvertStats()
+
+    with h5py.File(h5_name, mode) as f:
+
+        # 已写入的小时及来源
+        old_files, old_sizes, old_mtimes, old_times = [], [], [], []
+        if 'data' in f:
+            assert f['dt'][()]==dt
+            old_files = [n.decode() for n in f['raw_files'][:]]
+            nh_old = len(old_files)
+            old_sizes  = list(f['raw_sizes'][:])  if 'raw_sizes'  in f else [-1]*nh_old
+            old_mtimes = list(f['raw_mtimes'][:]) if 'raw_mtimes' in f else [-1.]*nh_old
+            old_times  = list(f['Times'][:])
+        slots = {file:k for k, file in enumerate(old_files)}
+
+        all_files, sizes, mtimes, t_all = old_files, old_sizes, old_mtimes, old_times
+        _, new_sizes, new_mtimes = file_provenance(bins_file, catalog=catalog)
+
+        todo = []
+        for file, size, mtime in zip(bins_file, new_sizes, new_mtimes):
+            if file in slots:
+                k = slots[file]
+                if sizes[k]==size and mtimes[k]==mtime:
+                    stats.count('skipped_files', station=file.split(PATH_MARKER)[-2])
+                    continue
+            else:
+                k = len(all_files)
+                slots[file] = k
+                t_string = file.split(PATH_MARKER)[-1]
+                all_files.append(file)
+                sizes.append(0)
+                mtimes.append(0.)
+                t_all.append(int(t_string[0:8]))
+            sizes[k]  = size
+            mtimes[k] = mtime
+            todo.append((k, file, size))
+
+        nh = len(all_files)
+        print(f'write {len(todo)} files to {h5_name}')
+        labels = [(file.split(PATH_MARKER)[-2], file.split(PATH_MARKER)[-1][0:8]) for _, file, _ in todo]
+        reader = _prefetch_timed([file for _, file, _ in todo], prefetch, stats, labels)
+        for (k, file, size), (sn, hour), (_, raw) in tqdm.tqdm(zip(todo, labels, reader), total=len(todo)):
+
+            with stats.stage('decode', station=sn, hour=hour, nbytes=size):
+                f_header, data_i, _ = read_bin(file, dt=dt*1000, DB=DB, mmap=raw_counts, raw=raw, cache=False)
+                if raw_counts:
+                    data_i = np.ascontiguousarray(data_i.counts).reshape([data_i.shape[0], -1])
+
+            # 按第一个文件的尺寸分配, 可沿小时方向扩展
+            if 'data' not in f:
+                nc, nt = data_i.shape
+                storage = h5_storage((nh, nc, nt), dt, compression=compression, compression_opts=compression_opts,
+                                     shuffle=shuffle, chunk_seconds=chunk_seconds)
+                d_data = f.create_dataset('data', shape=(nh, nc, nt), maxshape=(None, nc, nt),
+                                          dtype=data_i.dtype, **storage)
+                _to_counts_attrs(d_data, raw_counts, DB)
+                f.create_dataset('headers', shape=(nh, len(f_header)), maxshape=(None, len(f_header)),
+                                 dtype=f_header.dtype)
+            d_data, d_headers = f['data'], f['headers']
+            if d_data.shape[0]<nh:
+                d_data.resize(nh, axis=0)
+                d_headers.resize(nh, axis=0)
+            assert data_i.shape==d_data.shape[1:]
+
+            with stats.stage('write', station=sn, hour=hour, nbytes=data_i.nbytes):
+                d_data[k] = data_i
+                d_headers[k] = f_header
+
+        if 'data' not in f:
+            return
+        nc = f['data'].shape[1]
+        _replace_dataset(f, 'Times', np.array(t_all))
+        _replace_dataset(f, 'dt', dt)
+        _replace_dataset(f, 'N_hours', nh)
+        _replace_dataset(f, 'chns', CHN_DEF[nc])
+        _replace_dataset(f, 'raw_files', np.array(all_files, dtype='S'))
+        _replace_dataset(f, 'raw_sizes', np.array(sizes, dtype='int64'))
+        _replace_dataset(f, 'raw_mtimes', np.array(mtimes, dtype='float64'))
+
+
+def follow2h5(bin_file, h5, dt=0.002, N_CHN=1, DB=0, interval=1.0, timeout=None,
+              group='/', swmr=False, chunk_seconds=60, stats=None) -> int:
+    '''
+    跟踪正在写入的BIN文件, 新写完的数据块逐次追加到h5数据集, 延迟约为interval秒
+    {group}/data    [N_CHN, nt], float32
+    {group}/headers [N_CHN, n_block, 12], int32
+    已有数据集时从已写入的数据块之后继续
+
+    bin_file : 正在写入的BIN文件
+    h5       : h5文件名, 或已打开的 h5py.File/Group
+    dt       : 采样间隔, 单位s
+    N_CHN    : 通道数
+    DB       : 增益率
+    interval : 检查文件的间隔, s
+    timeout  : 没有新数据的最长等待时间, s, None为一直等待到写满一小时
+    group    : 数据集所在的组
+    swmr     : h5为文件名时以SWMR(single-writer multiple-reader)模式写入,
+               其他进程可用 h5py.File(h5, 'r', libver='latest', swmr=True) 同时读取
+    chunk_seconds: 每个chunk的时长(s)
+    stats    : ConvertStats, 写入阶段计时
+
+    out: 本次追加的数据块数(每个通道)
+    '''
+    import h5py
+
+    if stats is None:
+        stats = ConvertStats()
+    own = isinstance(h5, (str, os.PathLike))
+    f = h5py.File(h5, 'a', libver='latest' if swmr else 'earliest') if own else h5
+    try:
+        g = f.require_group(group)
+        follower = BinFollower(bin_file, N_CHN=N_CHN, dt=dt*1000, DB=DB)
+        if 'data' not in g:
+            nb_chunk = max(int(chunk_seconds/dt/DATA_SIZE), 1)
+            d = g.create_dataset('data', shape=(N_CHN, 0), maxshape=(N_CHN, None),
+                                 chunks=(N_CHN, nb_chunk*DATA_SIZE), dtype='float32')
+            d.attrs['dt'] = dt
+            d.attrs['file'] = bin_file
+            g.create_dataset('headers', shape=(N_CHN, 0, follower.HS), maxshape=(N_CHN, None, follower.HS),
+                             chunks=(N_CHN, nb_chunk, follower.HS), dtype='int32')
+        d_data, d_headers = g['data'], g['headers']
+        assert d_data.shape[0]==N_CHN
+        follower.seek(d_headers.shape[1])
+        if own and swmr:
+            f.swmr_mode = True
+
+        n0 = follower.n_block
+        sn = bin_file.split('/')[-2] if '/' in bin_file else None
+        for data, headers in follower.follow(interval=interval, timeout=timeout):
+            with stats.stage('write', station=sn, nbytes=data.nbytes):
+                nt, nb = d_data.shape[1], d_headers.shape[1]
+                d_data.resize(nt+data.shape[1], axis=1)
+                d_data[:, nt:] = data
+                d_headers.resize(nb+headers.shape[1], axis=1)
+                d_headers[:, nb:] = headers
+                f.flush()
+        return follower.n_block-n0
+    finally:
+        if own:
+            f.close()
+
+
+def _day_buffer(buffers:dict, key, shape, dtype) -> tuple:
+    # buffers: {用途: (np.array, 每小时是否已写入数据)}, 见 station_day(buffers=)
+    # 新分配的np.zeros在写入前不占用物理内存; dirty 记录写过的小时, 缺失的小时只对写过的部分重新置零
+    if key in buffers:
+        buffer, dirty = buffers[key]
+        if buffer.shape==tuple(shape) and buffer.dtype==np.dtype(dtype):
+            return buffer, dirty
+        del buffers[key], buffer
+    buffer, dirty = np.zeros(shape, dtype=dtype), np.zeros(24, dtype=bool)
+    buffers[key] = (buffer, dirty)
+    return buffer, dirty
+
+
+def station_day(path_sn, date, N_CHN=1, DB=0, dt=0.002, DOWNSAMPLE_RATE=5, files=None,
+                raw_counts=False, prefetch=2, qc=None, buffers=None, stats=None) -> tuple:
+    '''
+    读取一个台站一天的24个文件, 按数据块健康度(block_health)置零并降采样
 
-    headers = []
-    data = []
-    t_all = []
-    for file in tqdm.tqdm(bins_file):
-    # for file in files:
-        t_string = file.split(PATH_MARKER)[-1]
-        y = int(t_string[0:2])
-        m = int(t_string[2:4])
-        d = int(t_string[4:6])
-        h = int(t_string[6:8])
-        t_s =  int(t_string[0:8])
-
-        f_header, data_i, _ = read_bin(file, dt=dt*1000)
-        
-        headers.append(f_header)
-        data.append(data_i)
-        t_all.append(t_s)
+    path_sn    : 台站文件夹
+    date       : 指定日期
+    N_CHN      : 通道数
+    DB         : 增益率
+    dt         : 采样间隔, 单位s
+    DOWNSAMPLE_RATE：降采样率， 整数
+    files      : 24个小时的文件名, 缺失的小时为None; 不提供则检查 {path_sn}/{date}{hour}.BIN 是否存在
+    raw_counts : 输出int32原始count(降采样后四舍五入), 乘以 COUNT2V*DB_FACTOR[DB] 得到电压
+    prefetch   : 后台预读的文件数, 0 为不预读
+    qc         : 'raw' 每小时置零后、降采前计算QC统计; 'decimated' 在降采后的数据上计算; None 不计算,
+                 见qc_stats, 缺失的小时为nan
+    buffers    : dict, 整天数据及降采结果的缓冲区; 多次调用传入同一个dict时复用, 不再为每个台站重新分配,
+                 返回的数据在下一次使用该dict的调用前有效, 需要保留时自行复制; 丢弃dict即释放内存
+    stats      : ConvertStats, 分阶段计时及缺失/不健康数据的计数, 以台站文件夹名为station
+
+    out: (每个数据块的健康度[24*3600/(DATA_SIZE*dt)], 每个数据块的块头表(第0通道, 缺失的小时为0)
+          BHEADER_TABLE_DTYPE [24*3600/(DATA_SIZE*dt)], 降采后的数据[N_CHN, NT_aday_DW])
+         qc 不为None时另有第4项: QC统计 dict, 见qc_stats
+    '''
+    hours=[f'{i:02d}' for i in range(24)]
+    if stats is None:
+        stats = ConvertStats()
+    sn = os.path.basename(os.path.normpath(path_sn))
 
-    headers = np.array(headers)
-    data = np.array(data)
-    t_all = np.array(t_all)
+    NT_aday   =  int(3600*24/dt)
+    NT_ahour  =  int(3600/dt)
+    NB_ahour  =  NT_ahour//DATA_SIZE
 
-    nh, nc, nt = data.shape
-    
-    print(f'write {headers.shape[0]} files to {h5_name}')
-    with h5py.File(h5_name,'w') as f:
-        f.create_dataset('data', data=data)
-        f.create_dataset('headers', data=headers)
-        f.create_dataset('Times',data=t_all)
-        f.create_dataset('dt',data=dt)
-        f.create_dataset('N_hours',data=nh)
-        f.create_dataset('chns',data=CHN_DEF[nc])
-        f.create_dataset('raw_files',data=np.array(bins_file, dtype='S'))
+    dtype = 'int32' if raw_counts else 'float32'
+    if buffers is not None:
+        data_day, dirty = _day_buffer(buffers, 'day', [N_CHN, NT_aday], dtype)
+    else:
+        data_day, dirty = np.zeros([N_CHN, NT_aday], dtype=dtype), np.zeros(len(hours), dtype=bool)
+    health_i = np.ones(len(hours)*NB_ahour, dtype='float32')
+
+    # 读数据
+    if files is None:
+        files = [f'{path_sn}/{date}{hour}.BIN' for hour in hours]
+        files = [file if os.path.exists(file) else None for file in files]
+
+    table = np.zeros(len(hours)*NB_ahour, dtype=BHEADER_TABLE_DTYPE)
+    assert qc in (None, 'raw', 'decimated')
+    clip = CLIP_LEVEL*2**31*(1 if raw_counts else COUNT2V*DB_FACTOR[DB])
+    qc_hours = []
+    reader = _prefetch_timed(files, prefetch, stats, [(sn, hour) for hour in hours])
+    for j, (file_ij, raw) in enumerate(reader):
+
+        sp = j*NT_ahour
+        ep = (j+1)*NT_ahour
+        if file_ij is None:
+            health_i[j*NB_ahour:(j+1)*NB_ahour]=0
+            if dirty[j]:
+                data_day[:,sp:ep] = 0
+                dirty[j] = False
+            if qc=='raw':
+                qc_hours.append(qc_empty([N_CHN], 1, dt))
+            stats.count('missing_minutes', 60, station=sn)
+            continue
+
+        # 只解码文件结构, 数据为raw(或memmap)上的count视图, 缩放时直接写入data_day
+        with stats.stage('decode', station=sn, hour=hours[j], nbytes=raw.nbytes):
+            H, data_ij, hs = read_bin(file_ij, dt=dt*1000,IS_Z_CHN=False, DB=DB, mmap=True, raw=raw)
+        # print(t_s,data.shape)
+        assert data_ij.shape[0]==N_CHN
+
+        with stats.stage('header', station=sn, hour=hours[j], nbytes=hs.nbytes):
+            # 块头表
+            table[j*NB_ahour:(j+1)*NB_ahour] = bheader_table(hs[0,:,:])
+
+            # 每个数据块的健康度, 所有通道均正常才为1
+            health_ij = block_health(hs, dt=dt*1000, date=int(date))
+            health_i[j*NB_ahour:(j+1)*NB_ahour] = health_ij.all(axis=0)
+        stats.count('unhealthy_minutes', float((~health_ij.all(axis=0)).sum()*DATA_SIZE*dt/60), station=sn)
+
+        # 缩放(raw_counts时复制)后写入data_day, 再将不健康的数据块原位置零
+        with stats.stage('health', station=sn, hour=hours[j], nbytes=data_ij.counts.nbytes):
+            data_hour = data_day[:,sp:ep].reshape([N_CHN, NB_ahour, DATA_SIZE])
+            dirty[j] = True
+            data_ij.scale_into(data_hour)
+            data_hour[~health_ij] = 0
+
+        # 数据仍在内存中, 顺带计算QC统计
+        if qc=='raw':
+            with stats.stage('qc', station=sn, hour=hours[j], nbytes=data_hour.nbytes):
+                qc_hours.append(qc_stats(data_day[:,sp:ep], dt, clip=clip))
+
+    # 降采
+    if DOWNSAMPLE_RATE>1:
+        with stats.stage('decimate', station=sn, nbytes=data_day.nbytes):
+            out = None if buffers is None else \
+                  _day_buffer(buffers, 'day_DW', [N_CHN, -(-NT_aday//DOWNSAMPLE_RATE)], dtype)[0]
+            data_day_DW = decimate(data_day, DOWNSAMPLE_RATE, dt=dt, out=out)
+    else:
+        data_day_DW=data_day
+
+    if qc is None:
+        return health_i, table, data_day_DW
+    if qc=='raw':
+        qc_i = qc_concatenate(qc_hours)
+    else:
+        with stats.stage('qc', station=sn, nbytes=data_day_DW.nbytes):
+            qc_i = qc_stats(data_day_DW, dt*DOWNSAMPLE_RATE, clip=clip)
+            # 缺失的小时为nan
+            missing = [j for j, file_ij in enumerate(files) if file_ij is None]
+            for key in QC_KEYS:
+                qc_i[key].reshape([N_CHN, len(hours), -1])[:, missing] = np.nan
+    return health_i, table, data_day_DW, qc_i
+
+
+# 进程池子进程中各台站复用的缓冲区, 进程池关闭时随子进程释放; 主进程不使用
+_WORKER_BUFFERS = {}
+
+
+def _station_day_stats(*args):
+    # 子进程中的统计随结果一起返回, 在主进程合并
+    stats = ConvertStats()
+    out = station_day(*args, buffers=_WORKER_BUFFERS, stats=stats)
+    return out, stats.to_dict()
+
+
+def _imap_ordered(func, args_list, workers=1):
+    '''
+    按顺序返回func(*args)的结果; workers>1时在进程池中计算,
+    同时在途的任务不超过2*workers个, 避免结果堆积占用内存
+    '''
+    if workers<=1:
+        for args in args_list:
+            yield func(*args)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for args in args_list:
+            pending.append(pool.submit(func, *args))
+            if len(pending)>=2*workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _day_stations(ROOT_folder, date, sn2name={}, catalog=None) -> tuple:
+    '''
+    一天的台站文件夹、名称、24个小时的文件名(缺失为None)及来源信息(见file_provenance)
+    '''
+    if len(sn2name.keys())==0 and catalog is not None:
+        sns = [r['sn'].decode() for r in catalog['dirs']]
+    elif len(sn2name.keys())==0: 
+        sns = os.listdir(f"{ROOT_folder}/")
+    else:
+        sns = sn2name.keys()
+
+    hours=[f'{i:02d}' for i in range(24)]
+
+    path_sns, names_sns, files_sns, sources = [], [], [], []
+    for sn_i in sns:
+        path_sn = f"{ROOT_folder}/{sn_i}"
+        sn_i = path_sn.split(PATH_SEP)[-1]
+        name_i = sn2name[sn_i] if sn_i in sn2name.keys() else sn_i
+        path_sns.append(path_sn)
+        names_sns.append(name_i)
+        if catalog is None:
+            files = [f'{path_sn}/{date}{hour}.BIN' for hour in hours]
+            files = [file if os.path.exists(file) else None for file in files]
+            sources.append(file_provenance([file for file in files if file is not None]))
+        else:
+            records = catalog_select(catalog, sn=sn_i, date=date)
+            files = [None]*len(hours)
+            for r in records:
+                files[r['hour']] = f"{path_sn}/{date}{r['hour']:02d}.BIN"
+            sources.append((np.array([file for file in files if file is not None], dtype='S'),
+                            records['size'].astype('int64'), records['mtime'].astype('float64')))
+        files_sns.append(files)
+
+    return path_sns, names_sns, files_sns, sources
+
+
+def _day_results(jobs, workers, stats):
+    '''
+    按顺序返回各台站 station_day 的结果, workers>1时子进程的统计在主进程合并
+
+    每个台站的结果写出(或由子进程返回)后才读取下一个台站, 各台站复用整天数据的缓冲区;
+    缓冲区只在本次调用(或子进程)内有效, 返回后即释放
+    '''
+    if workers>1:
+        for out, stats_i in _imap_ordered(_station_day_stats, jobs, workers=workers):
+            stats.merge(stats_i)
+            yield out
+    else:
+        buffers = {}
+        yield from _imap_ordered(partial(station_day, buffers=buffers, stats=stats), jobs)
 
 
 def bins2h5_day(ROOT_folder, h5_name,date, header_file_pattern='./{date}_{name}.csv',
                 N_CHN=1, DB=0,
                 dt=0.002, PATH_MARKER=PATH_SEP, DOWNSAMPLE_RATE=5, 
-                sn2name={}) -> any:
+                sn2name={}, workers=1, mode='w', catalog=None,
+                raw_counts=False, compression=None, compression_opts=None, shuffle=False,
+                chunk_seconds=None, stats=None, prefetch=2, header_table=False, qc=None) -> any:
     '''
     把所有台站同一天的文件转成一个统一格式的,大H5文件
 
     ROOT_folder: 原始文件根目录
     h5_name    : 生成的h5文件名
     date       : 指定日期
-    header_file_pattern: 头文件信息的写入位置， eg: 'path/{date}_{name}.csv'
+    header_file_pattern: 头文件信息的写入位置(每分钟一条)， eg: 'path/{date}_{name}.csv', None则不写
     
     N_CHN      : 通道数
     DB         : 增益率
@@ -320,105 +935,325 @@ def bins2h5_day(ROOT_folder, h5_name,date, header_file_pattern='./{date}_{name}.
     DOWNSAMPLE_RATE：降采样率， 整数
     PATH_MARKER: 路径分割符号
     sn2name    : 仪器号转名称
+    workers    : 读取/健康度/降采样的进程数, 写入始终在主进程按台站顺序进行,
+                 结果与workers=1完全相同
+    mode       : 'w' 重新生成; 'a' 追加/续写, 跳过data/{name}中来源文件(路径,大小,修改时间)
+                 未变化的台站, 只转换新增或有变化的台站并原位更新
+    catalog    : build_catalog 生成的文件目录, 提供时不再列目录和检查文件是否存在,
+                 台站为catalog中的全部台站文件夹(按名称排序)
+    raw_counts : data/{name} 保存为int32原始count(降采样后四舍五入),
+                 属性 attrs['scale']=COUNT2V*DB_FACTOR[DB]
+    compression, compression_opts, shuffle, chunk_seconds: 存储参数, 见h5_storage,
+                 eg: chunk_seconds=60, compression='lzf', shuffle=True
+    stats      : ConvertStats, 分阶段计时(read/header/health/decimate/write)及每个台站
+                 缺失/不健康的分钟数; workers>1时子进程的统计在主进程合并
+    prefetch   : 每个台站后台预读的小时文件数, 读取与健康度/降采样重叠; 0 为不预读
+    header_table: 把每个数据块的块头表写入 headers/{name} (BHEADER_TABLE_DTYPE [NB_aday],
+                 缺失的小时为0), 时间索引写入 header_index/{name}, 用于 time_to_sample
+    qc         : 转换时顺带计算QC统计(见qc_stats), 'raw' 在降采前, 'decimated' 在降采后;
+                 写入 qc/{name}/rms, max, clipped [N_CHN, 1440] 和 qc/{name}/psd [N_CHN, 24, n_freq],
+                 频带中心频率写入 qc/freq, 缺失的小时为nan
     '''
-    if len(sn2name.keys())==0: 
-        sns = os.listdir(f"{ROOT_folder}/")
-    else:
-        sns = sn2name.keys()
-
+    import h5py
 
-    hours=[f'{i:02d}' for i in range(24)]
+    if stats is None:
+        stats = ConvertStats()
 
-    NT_aday   =  int(3600*24/dt)
-    NT_ahour  =  int(3600/dt)
-    NT_amin   =  int(60/dt)
     NT_aday_DW = int(3600*24/dt/DOWNSAMPLE_RATE)
+    NB_aday    = int(3600*24/dt/DATA_SIZE)
     # print(NT_aday,NT_ahour,NT_aday_DW)
 
-    h5file = h5py.File(h5_name,'w')
+    h5file = h5py.File(h5_name,mode)
 
-    h5file.create_group('data')
-    # t = np.arange(NT_aday_DW)*dt*DOWNSAMPLE_RATE/1000
-    # print(t, len(t))
-    h5file.create_dataset('nt', data=NT_aday_DW)
-    h5file.create_dataset('dt', data=dt*DOWNSAMPLE_RATE)
-    h5file.create_dataset('ns', data=len(sns))
-
-    names = []
-    health = np.ones([len(sns),len(hours)*60], dtype='float32')
-    for i, sn_i in enumerate(sns):
-        path_sn = f"{ROOT_folder}/{sn_i}"
-        sn_i = path_sn.split(PATH_SEP)[-1]
-        if sn_i in sn2name.keys():
-            name_i = sn2name[sn_i]
-        else:
-            name_i = sn_i
-
-        data_day = np.zeros([N_CHN, NT_aday],dtype='float32')
-        health_i = np.ones(len(hours)*60, dtype='float32')
-
-        # 读数据
-        header_list = []
-        for j, hour in enumerate(hours):
-
-            file_ij = f'{path_sn}/{date}{hour}.BIN'
-            if not os.path.exists(file_ij):
-                health_i[j*60:(j+1)*60]=0
+    if 'data' in h5file:
+        assert h5file['nt'][()]==NT_aday_DW and h5file['dt'][()]==dt*DOWNSAMPLE_RATE
+        old_names = [n.decode() for n in h5file['names'][:]] if 'names' in h5file else []
+        old_health = dict(zip(old_names, h5file['health'][:])) if 'health' in h5file else {}
+        assert 'health' not in h5file or h5file['health'].shape[1]==NB_aday # 与旧的分钟健康度不兼容
+    else:
+        old_names, old_health = [], {}
+        h5file.create_group('data')
+        # t = np.arange(NT_aday_DW)*dt*DOWNSAMPLE_RATE/1000
+        # print(t, len(t))
+        h5file.create_dataset('nt', data=NT_aday_DW)
+        h5file.create_dataset('dt', data=dt*DOWNSAMPLE_RATE)
+
+    # 台站名称及来源文件
+    path_sns, names_sns, files_sns, sources = _day_stations(ROOT_folder, date, sn2name, catalog)
+
+    # 续写时跳过来源未变化的台站
+    todo = []
+    for i, name_i in enumerate(names_sns):
+        if f'data/{name_i}' in h5file:
+            attrs = h5file[f'data/{name_i}'].attrs
+            if 'raw_files' in attrs and 'health' in attrs and \
+                all(np.array_equal(attrs[k], v) for k, v in zip(['raw_files', 'raw_sizes', 'raw_mtimes'], sources[i])):
                 continue
+        todo.append(i)
+    jobs = [(path_sns[i], date, N_CHN, DB, dt, DOWNSAMPLE_RATE, files_sns[i], raw_counts, prefetch, qc)
+            for i in todo]
+    storage = h5_storage((N_CHN, NT_aday_DW), dt*DOWNSAMPLE_RATE, compression=compression,
+                         compression_opts=compression_opts, shuffle=shuffle, chunk_seconds=chunk_seconds)
+
+    results = _day_results(jobs, workers, stats)
+    for k, (i, result) in enumerate(zip(todo, results)):
+        health_i, table, data_day_DW = result[:3]
+        path_sn, name_i = path_sns[i], names_sns[i]
+        sn_i = path_sn.split(PATH_SEP)[-1]
 
-            H, data_ij, hs = read_bin(file_ij, dt=dt*1000,IS_Z_CHN=False, DB=DB)
-            # print(t_s,data.shape)
-            assert data_ij.shape[0]==N_CHN
-
-            # 头文件每分钟采样
-            inf_lines = bheader2list(hs[0,:,:], start=0, interval=int(60/dt/DATA_SIZE))
-            header_list+=inf_lines
+        with stats.stage('write', station=sn_i, nbytes=data_day_DW.nbytes):
+            # 写头文件
+            if health_i.sum()>=1 and header_file_pattern is not None:
+                file_name = header_file_pattern.format(date=date, name=name_i)
+                bheader_table2csv(table[::int(60/dt/DATA_SIZE)],file_name, REMOVE_ZERO=True, date=int(date))
+            if header_table:
+                _replace_dataset(h5file, f'headers/{name_i}', table)
+                _replace_dataset(h5file, f'header_index/{name_i}', bheader_time_index(table))
+            if qc is not None:
+                qc_i = result[3]
+                for key in QC_KEYS:
+                    _replace_dataset(h5file, f'qc/{name_i}/{key}', qc_i[key])
+                h5file[f'qc/{name_i}'].attrs['stage'] = qc
+                _replace_dataset(h5file, 'qc/freq', qc_i['freq'])
+
+            # print(data_day_DW.mean(),data_day_DW.max())
+            # 写入
+            if f'data/{name_i}' in h5file and h5file[f'data/{name_i}'].dtype==data_day_DW.dtype:
+                d = h5file[f'data/{name_i}']
+                d[...] = data_day_DW
+            else:
+                if f'data/{name_i}' in h5file:
+                    del h5file[f'data/{name_i}']
+                d = h5file.create_dataset(f'data/{name_i}', data=data_day_DW, **storage)
+                _to_counts_attrs(d, raw_counts, DB)
+            d.attrs['health'] = np.packbits(health_i>0) # 按位保存, 属性不能超过64KB
+            for key, v in zip(['raw_files', 'raw_sizes', 'raw_mtimes'], sources[i]):
+                d.attrs[key] = v
+            h5file.flush()
+        
+        print(k,len(todo),date, path_sn, name_i)
+
+    # 台站顺序: 已有的names, 再按本次台站顺序, 最后是其他已写入的台站
+    names = list(old_names)
+    for name_i in names_sns+list(h5file['data'].keys()):
+        if name_i not in names:
+            names.append(name_i)
+    health = np.zeros([len(names),NB_aday], dtype='float32')
+    for i, name_i in enumerate(names):
+        attrs = h5file[f'data/{name_i}'].attrs
+        health[i,:] = np.unpackbits(attrs['health'], count=NB_aday) if 'health' in attrs else old_health[name_i]
+
+    _replace_dataset(h5file, 'ns', len(names))
+    _replace_dataset(h5file, 'health', health)
+    _replace_dataset(h5file, 'health_dt', DATA_SIZE*dt)
+    _replace_dataset(h5file, 'names', np.array(names, dtype='S'))
+    _replace_dataset(h5file, 'date', date)
+    h5file.close()
 
-            # 为分钟值的健康度赋值
-            health_i[j*60:(j+1)*60] = (np.array(inf_lines)[:,0]==int(date))
 
-            # 不健康采样置零
-            data_ij = data_ij.reshape([N_CHN, 60,NT_amin])*health_i[j*60:(j+1)*60].reshape([1,60,1])
-            # print(data_ij.shape)
+def _save_npy(file_name, data):
+    # 先写临时文件再替换, 读取方不会看到写了一半的文件
+    tmp = f'{file_name}.tmp.npy'
+    np.save(tmp, data)
+    os.replace(tmp, file_name)
 
-            sp = j*NT_ahour
-            ep = (j+1)*NT_ahour
 
-            data_day[:,sp:ep] = data_ij.reshape([N_CHN, -1])
+def bins2npy_day(ROOT_folder, out_dir, date, header_file_pattern=None,
+                 N_CHN=1, DB=0, dt=0.002, DOWNSAMPLE_RATE=5,
+                 sn2name={}, workers=1, catalog=None, raw_counts=False,
+                 stats=None, prefetch=2) -> any:
+    '''
+    与bins2h5_day相同的处理(健康度置零、降采样), 输出为每个台站一个平坦的.npy文件,
+    读取时可 np.load(mmap_mode='r') 直接切片任意台站和时间窗, 不复制数据, 也不需要h5py
 
+    {out_dir}/{name}.npy : [N_CHN, nt], float32 (raw_counts时为int32原始count)
+    {out_dir}/index.npz  : names, health [ns, NB_aday], health_dt, dt, nt, date, scale
+                           (scale: 乘以该值得到电压, 非raw_counts时为1)
 
-        # 写头文件
-        if health_i.sum()>=1 and header_file_pattern is not None:
-            file_name = header_file_pattern.format(date=date, name=name_i)
-            bheader_list2csv(header_list,file_name, REMOVE_ZERO=True, date=int(date))
-    
-        # 降采
-        if DOWNSAMPLE_RATE>1:
-
-            data_day_DW = np.zeros([N_CHN, NT_aday_DW],dtype='float32')
-            for k in range(N_CHN):
-                trace = Trace(data_day[k,:])
-                trace = trace.decimate(DOWNSAMPLE_RATE)
-                data_day_DW[k,:] = trace.data
-        else:
-            data_day_DW=data_day
-            
-        # print(data_day_DW.mean(),data_day_DW.max())
-        # 写入
-        health[i,:] = health_i
-        h5file.create_dataset(f'data/{name_i}', data=data_day_DW)
-        
-        print(i,len(sns),date, path_sn, name_i)
-        names.append(name_i)
-    h5file.create_dataset(f'health', data=health)
-    h5file.create_dataset(f'names', data=np.array(names, dtype='S'))
-    h5file.close()
+    ROOT_folder, date, header_file_pattern, N_CHN, DB, dt, DOWNSAMPLE_RATE, sn2name,
+    workers, catalog, raw_counts, stats, prefetch: 见bins2h5_day
+    out_dir    : 输出文件夹, 建议每天一个
 
+    eg:
+        day = load_npy_day('./npy/240528')
+        day['data']['A0000102'][:, sp:ep]
+    '''
+    if stats is None:
+        stats = ConvertStats()
+    os.makedirs(out_dir, exist_ok=True)
 
+    NT_aday_DW = int(3600*24/dt/DOWNSAMPLE_RATE)
+    NB_aday    = int(3600*24/dt/DATA_SIZE)
+
+    path_sns, names_sns, files_sns, _ = _day_stations(ROOT_folder, date, sn2name, catalog)
+    jobs = [(path_sns[i], date, N_CHN, DB, dt, DOWNSAMPLE_RATE, files_sns[i], raw_counts, prefetch)
+            for i in range(len(path_sns))]
+
+    health = np.zeros([len(names_sns), NB_aday], dtype='float32')
+    for i, (health_i, table, data_day_DW) in enumerate(_day_results(jobs, workers, stats)):
+        path_sn, name_i = path_sns[i], names_sns[i]
+        assert data_day_DW.shape==(N_CHN, NT_aday_DW)
+
+        with stats.stage('write', station=path_sn.split(PATH_SEP)[-1], nbytes=data_day_DW.nbytes):
+            if health_i.sum()>=1 and header_file_pattern is not None:
+                file_name = header_file_pattern.format(date=date, name=name_i)
+                bheader_table2csv(table[::int(60/dt/DATA_SIZE)],file_name, REMOVE_ZERO=True, date=int(date))
+            _save_npy(f'{out_dir}/{name_i}.npy', data_day_DW)
+        health[i] = health_i
+
+        print(i,len(jobs),date, path_sn, name_i)
+
+    index = {
+        'names'    : np.array(names_sns, dtype='U'),
+        'health'   : health,
+        'health_dt': DATA_SIZE*dt,
+        'dt'       : dt*DOWNSAMPLE_RATE,
+        'nt'       : NT_aday_DW,
+        'date'     : date,
+        'scale'    : COUNT2V*DB_FACTOR[DB] if raw_counts else 1.0,
+    }
+    tmp = f'{out_dir}/index.tmp.npz'
+    np.savez(tmp, **index)
+    os.replace(tmp, f'{out_dir}/index.npz')
+
+
+def load_npy_day(out_dir, mmap_mode='r') -> dict:
+    '''
+    读取 bins2npy_day 的输出
 
-        
+    out_dir  : 输出文件夹
+    mmap_mode: np.load 的 mmap_mode, 'r' 为只读内存映射, None 为读入内存
 
+    out: index.npz 中的各项(names 为 list, 其他为 np.array 或标量),
+         以及 'data': {name: [N_CHN, nt] 数组}
+    '''
+    with np.load(f'{out_dir}/index.npz') as f:
+        day = {key: f[key][()] if f[key].ndim==0 else f[key] for key in f.files}
+    day['names'] = [str(name) for name in day['names']]
+    day['date'] = str(day['date'])
+    day['data'] = {name: np.load(f'{out_dir}/{name}.npy', mmap_mode=mmap_mode) for name in day['names']}
+    return day
 
 
+def _h5_day_date(f) -> str:
+    '''
+    bins2h5_day 输出(已打开的h5py.File)的日期 YYMMDD, 旧文件没有date时由文件名中的6位数字得到
+    '''
+    if 'date' in f:
+        date = f['date'][()]
+        return date.decode() if isinstance(date, bytes) else str(date)
+    return re.search(r'\d{6}', os.path.basename(f.filename)).group()
 
 
+def _h5_segments(f, names=None, date=None) -> list:
+    '''
+    bins2h5_day 或 bins2h5 输出(已打开的h5py.File)中的数据段
+    out: [(name, 开始时间 datetime64[us], h5py数据集, 小时序号或None, 健康度, 健康度间隔(s))]
+    '''
+    segments = []
+    if 'Times' in f:
+        # bins2h5: data [nh, N_CHN, nt], 每个小时一段
+        raw_files = [n.decode() for n in f['raw_files'][:]]
+        name = names if isinstance(names, str) else os.path.basename(os.path.dirname(raw_files[0]))
+        d = f['data']
+        nb = int(d.shape[2]//DATA_SIZE)
+        for k, T in enumerate(f['Times'][:]):
+            T = f'{int(T):08d}'
+            t = np.datetime64(f'20{T[0:2]}-{T[2:4]}-{T[4:6]}T{T[6:8]}', 'us')
+            segments.append((name, t, d, k, np.ones(nb, dtype='float32'), float(f['dt'][()])*DATA_SIZE))
+    else:
+        # bins2h5_day: data/{name} [N_CHN, nt], 每个台站一段
+        if date is None:
+            date = _h5_day_date(f)
+        t = np.datetime64(f'20{date[0:2]}-{date[2:4]}-{date[4:6]}', 'us')
+        health_dt = float(f['health_dt'][()])
+        for name, health in zip(f['names'][:], f['health'][:]):
+            name = name.decode()
+            segments.append((name, t, f[f'data/{name}'], None, health, health_dt))
+    return segments
+
+
+def h5_virtual(h5_files:list, vds_name, fill_value=0, names=None, dates=None) -> any:
+    '''
+    把多天的 bins2h5_day 输出和/或 bins2h5 输出拼接为一个连续的虚拟数据集(HDF5 virtual dataset),
+    只写入到原文件的映射和元数据, 不复制数据; 原文件需保持在原位置
+
+    h5_files : h5文件名 list
+    vds_name : 生成的h5文件名
+    fill_value: 缺失的天/小时/台站的填充值
+    names    : bins2h5 输出对应的台站名 {文件名: name}, 默认为原始文件所在的文件夹名(仪器号)
+    dates    : bins2h5_day 输出对应的日期 {文件名: YYMMDD}, 默认读取文件中的date,
+               旧文件由文件名中的6位数字得到
+
+    生成的数据集:
+    data       : [ns, N_CHN, nt] 虚拟数据集, 第一个采样点时间为 starttime
+    names      : [ns] 台站名
+    health     : [ns, nt*dt/health_dt] 每个数据块的健康度, 缺失为0
+    starttime  : 第一个采样点时间 'YYYY-MM-DDTHH:MM:SS'
+    dt, nt, health_dt, sources(原文件名)
+    '''
+    import h5py
+
+    names = {} if names is None else names
+    dates = {} if dates is None else dates
+    h5_list = [h5py.File(os.path.abspath(file), 'r') for file in h5_files]
+    try:
+        _h5_virtual(h5_list, h5_files, vds_name, fill_value, names, dates)
+    finally:
+        for f in h5_list:
+            f.close()
+
+
+def _h5_virtual(h5_list, h5_files, vds_name, fill_value, names, dates):
+    import h5py
+
+    segments = []
+    for f, file in zip(h5_list, h5_files):
+        segments += _h5_segments(f, names=names.get(file), date=dates.get(file))
+    assert len(segments)>0
+
+    d0 = segments[0][2]
+    dt = float(d0.file['dt'][()])
+    health_dt = segments[0][5]
+    nc, dtype = d0.shape[-2], d0.dtype
+    for _, _, d, _, _, hdt in segments:
+        assert float(d.file['dt'][()])==dt and hdt==health_dt, 'dt of all files must be the same'
+        assert d.shape[-2]==nc and d.dtype==dtype
+
+    us = np.timedelta64(1, 'us')
+    t0 = min(seg[1] for seg in segments)
+    def sample(t):
+        return int(round((t-t0)/us*1e-6/dt))
+    nt = max(sample(t)+d.shape[-1] for _, t, d, _, _, _ in segments)
+    nb = int(round(nt*dt/health_dt))
+
+    station_names = []
+    for seg in segments:
+        if seg[0] not in station_names:
+            station_names.append(seg[0])
+    ns = len(station_names)
+
+    layout = h5py.VirtualLayout(shape=(ns, nc, nt), dtype=dtype)
+    health = np.zeros([ns, nb], dtype='float32')
+    for name, t, d, k, health_i, _ in segments:
+        i = station_names.index(name)
+        sp = sample(t)
+        source = h5py.VirtualSource(d)
+        if k is not None:
+            source = source[k]
+        layout[i, :, sp:sp+d.shape[-1]] = source
+        bp = int(round(sp*dt/health_dt))
+        health[i, bp:bp+len(health_i)] = health_i
+
+    with h5py.File(vds_name, 'w', libver='latest') as f:
+        vds = f.create_virtual_dataset('data', layout, fillvalue=fill_value)
+        for key in ['scale', 'units']:
+            if key in d0.attrs:
+                vds.attrs[key] = d0.attrs[key]
+        f.create_dataset('names', data=np.array(station_names, dtype='S'))
+        f.create_dataset('health', data=health)
+        f.create_dataset('health_dt', data=health_dt)
+        f.create_dataset('dt', data=dt)
+        f.create_dataset('nt', data=nt)
+        f.create_dataset('starttime', data=str(t0.astype('datetime64[s]')))
+        f.create_dataset('sources', data=np.array([os.path.abspath(file) for file in h5_files], dtype='S'))
@@ -0,0 +1,114 @@
+import numpy as np
+from functools import lru_cache
+from fractions import Fraction
+# scipy.signal 在函数中导入, import pygdst 时不加载
+
+
+@lru_cache(maxsize=64)
+def decimation_sos(dt, factor, maxorder=12) -> np.array:
+    '''
+    设计降采样的抗混叠滤波器(cheby2 低通, 阻带衰减96dB), 与obspy Trace.decimate一致,
+    每个(dt, factor)只设计一次
+
+    dt       : 采样间隔, 单位s
+    factor   : 降采样率, 整数
+    maxorder : 滤波器最大阶数
+
+    out: sos, [n_sections, 6]
+    '''
+    from scipy.signal import cheb2ord, cheby2
+
+    df = 1.0/dt
+    nyquist = df*0.5
+    freq = df*0.5/float(factor)
+
+    rp, rs, order = 1, 96, 1e99
+    ws = min(freq/nyquist, 1.0) # 阻带频率
+    wp = ws                     # 通带频率
+    while order>maxorder:
+        wp = wp*0.99
+        order, wn = cheb2ord(wp, ws, rp, rs, analog=0)
+
+    return cheby2(order, rs, wn, btype='low', analog=0, output='sos')
+
+
+def decimate(data:np.array, factor:int, dt=1.0, chunk=2**16, zi=None, out=None, phase=0) -> np.array:
+    '''
+    对多道数据沿最后一维统一降采样, 结果与逐道 obspy Trace.decimate 相同
+
+    data   : np.array, [..., nt], eg: [N_CHN, nt] 或 [n_station, N_CHN, nt]
+    factor : 降采样率, 整数
+    dt     : 采样间隔, 单位s, 只影响滤波器缓存的键
+    chunk  : 每次滤波的时间采样数, 分段滤波时携带滤波器状态, 中间结果只占 chunk 大小的内存;
+             输入全为0且滤波器状态已衰减(<1e-60)的段直接输出0, 避免IIR拖尾进入非规格化数
+             (denormal)后计算变慢数十倍, 对float32输出无影响
+    zi     : 上一段数据结束时的滤波器状态, 用于逐小时流式降采样;
+             第一段传入 decimation_zi(data.shape, factor, dt)
+    out    : 输出数组 [..., ceil((nt-phase)/factor)], 提供时结果写入其中, 可在多次调用间复用
+    phase  : 保留的第一个采样点, 0<=phase<factor; 流式降采样时各段长度不是factor的整数倍,
+             下一段取 (-已处理的采样点数)%factor, 结果与整体降采样相同
+
+    out: np.array, [..., ceil((nt-phase)/factor)], 与data同dtype(整数时四舍五入); 若提供zi, 返回(out, zi)
+    '''
+    if factor<=1:
+        return data if zi is None else (data, zi)
+    if not 0<=phase<factor:
+        raise ValueError(f'phase must be in [0, {factor}), got {phase}')
+    from scipy.signal import sosfilt
+
+    sos = decimation_sos(dt, factor)
+    nt = data.shape[-1]
+    chunk = max(chunk//factor, 1)*factor
+
+    shape = data.shape[:-1]+(max(-(-(nt-phase)//factor), 0),)
+    if out is None:
+        out = np.empty(shape, dtype=data.dtype)
+    assert out.shape==shape
+    return_zi = zi is not None
+    if zi is None:
+        zi = decimation_zi(data.shape, factor, dt)
+    for sp in range(0, nt, chunk):
+        ep = min(sp+chunk, nt)
+        x = data[...,sp:ep]
+        if np.abs(zi).max()<1e-60 and not x.any():
+            zi = np.zeros_like(zi)
+            out[...,sp//factor:-(-(ep-phase)//factor)] = 0
+            continue
+        y, zi = sosfilt(sos, x, axis=-1, zi=zi)
+        y = y[...,phase::factor]
+        if out.dtype.kind in 'iu':
+            y = np.rint(y)
+        out[...,sp//factor:-(-(ep-phase)//factor)] = y
+
+    return (out, zi) if return_zi else out
+
+
+def decimation_zi(shape, factor:int, dt=1.0) -> np.array:
+    '''
+    降采样滤波器的初始状态(全0, 与obspy一致)
+
+    shape  : 数据尺寸 [..., nt]
+    factor : 降采样率, 整数
+    dt     : 采样间隔, 单位s
+    '''
+    sos = decimation_sos(dt, factor)
+    return np.zeros((sos.shape[0],)+tuple(shape[:-1])+(2,))
+
+
+def resample(data:np.array, dt:float, dt_new:float, max_denominator=1000) -> np.array:
+    '''
+    多相滤波重采样, 用于非整数倍的采样率转换, eg: 0.004s -> 0.01s
+
+    data   : np.array, [..., nt]
+    dt     : 原采样间隔, 单位s
+    dt_new : 新采样间隔, 单位s
+
+    out: np.array, [..., nt*dt/dt_new], 与data同dtype
+    '''
+    ratio = Fraction(dt_new/dt).limit_denominator(max_denominator)
+    down, up = ratio.numerator, ratio.denominator
+    if up==1:
+        return decimate(data, down, dt=dt)
+    from scipy.signal import resample_poly
+
+    return resample_poly(data, up, down, axis=-1).astype(data.dtype)
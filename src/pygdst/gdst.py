@@ -1,6 +1,12 @@
+import os
+import mmap
+import time
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from .paras import FHEADER_DEF, BHEADER_DEF,F_KEYS, B_KEYS
-from .paras import COUNT2V, BLOCK_SIZE, DATA_SIZE, DB_FACTOR
+from .paras import COUNT2V, BLOCK_SIZE, DATA_SIZE, DB_FACTOR, CHN_DEF
+from .cache import bin_cache
 
 
 def fheader_get_def(M=',', wanted=[]):
@@ -69,10 +75,161 @@ def bheader_decode(header) -> tuple:
     
     return date_UTC,time_UTC, lat, lon, seq1, seq2
 
+# block_header 前48字节按字节解析的结构, 与bheader_decode一致
+BHEADER_DTYPE = np.dtype({
+    'names'  : ['y', 'm', 'd', 'h', 's1', 's2', 'lat', 'lon', 'seq1', 'seq2'],
+    'formats': ['u1','u1','u1','u1','u1', 'u1', '<u4', '<u4', '<u4',  '<u4'],
+    'offsets': [18,  19,  20,  21,  22,   23,   24,    28,    32,     36],
+    'itemsize': 48,
+})
+
+def _ddmm2deg(v):
+    v = (v%2**28).astype(np.float64)
+    return v//1e6 + (v%1e6)/1e4 / 60.0
+
+def bheader_decode_all(headers) -> tuple:
+    '''
+    把所有block_header 中有效信息一次性解码出来, 与bheader_decode结果相同
+
+    headers: np.array(int32), [N_BLOCK, header_size]
+
+    out: 列数组 date_UTC,time_UTC, lat, lon, seq1, seq2
+    '''
+
+    H = np.ascontiguousarray(headers, dtype=np.int32)
+    H = H.reshape([-1, H.shape[-1]])[:, :BHEADER_DTYPE.itemsize//4]
+    H = np.ascontiguousarray(H).view(BHEADER_DTYPE)[:, 0]
+
+    y, m, d, h, s1, s2 = [H[k].astype(np.int64) for k in ['y', 'm', 'd', 'h', 's1', 's2']]
+    date_UTC = y*10000+m*100+d
+    time_UTC = h*10000+s1*100+s2
+
+    lat = _ddmm2deg(H['lat'])
+    lon = _ddmm2deg(H['lon'])
+
+    seq1 = H['seq1'].astype(np.int64)
+    seq2 = (H['seq2'] & 0xFFFFFF).astype(np.int64)
+
+    return date_UTC,time_UTC, lat, lon, seq1, seq2
+
+# 解码后的块头表, 每个数据块一条记录, 32字节
+BHEADER_TABLE_DTYPE = np.dtype([
+    ('date', '<i4'),   # YYMMDD
+    ('time', '<i4'),   # HHMMSS
+    ('lat',  '<f8'),
+    ('lon',  '<f8'),
+    ('seq1', '<u4'),
+    ('seq2', '<u4'),
+])
+
+def bheader_table(headers) -> np.array:
+    '''
+    把所有block_header 解码为结构化数组, 字段见 BHEADER_TABLE_DTYPE
+
+    headers: np.array(int32), [..., N_BLOCK, header_size]
+
+    out: [..., N_BLOCK] BHEADER_TABLE_DTYPE
+    '''
+    table = np.empty(headers.shape[:-1], dtype=BHEADER_TABLE_DTYPE)
+    for name, column in zip(BHEADER_TABLE_DTYPE.names, bheader_decode_all(headers)):
+        table[name] = column.reshape(table.shape)
+    return table
+
+def bheader_time_index(table:np.array) -> np.array:
+    '''
+    由块头表建立时间索引, 用于 time_to_sample; 跳过未采集(日期为0或无效)的数据块
+
+    table: [N_BLOCK] BHEADER_TABLE_DTYPE
+
+    out: 按时间排序的 [('t', UTC秒 int64), ('block', 数据块序号 int64)]
+    '''
+    table = table.reshape(-1)
+    y, m, d = 2000+table['date']//10000, table['date']//100%100, table['date']%100
+    block = np.flatnonzero((m>=1) & (m<=12) & (d>=1) & (d<=31))
+    y, m, d = [v[block].astype(np.int64) for v in (y, m, d)]
+    tod = table['time'][block].astype(np.int64)
+    day = ((y-1970).astype('datetime64[Y]') + (m-1).astype('timedelta64[M]')).astype('datetime64[D]') \
+          + (d-1).astype('timedelta64[D]')
+    t = day.astype(np.int64)*86400 + (tod//10000)*3600 + (tod//100%100)*60 + tod%100
+
+    index = np.empty(len(block), dtype=[('t', '<i8'), ('block', '<i8')])
+    index['t'], index['block'] = t, block
+    return np.sort(index, order=['t', 'block'], kind='stable')
+
+def time_to_sample(index:np.array, t, dt=1, data_size=DATA_SIZE) -> int:
+    '''
+    由块头时间索引查找时间t对应的采样点序号(按块头记录的时间, 而不是按文件名推算)
+
+    index    : bheader_time_index 的输出
+    t        : UTC时间, datetime, UTCDateTime, np.datetime64 或字符串
+    dt       : 采样率，单位ms
+    data_size: 单个数据块数据尺寸，默认500
+
+    out: 采样点序号(原始采样率, 降采样后除以降采样率); t早于所有数据块时为-1
+    '''
+    us = (_to_datetime64(t)-np.datetime64('1970-01-01', 'us')).astype(np.int64)
+    sec = us//1000000
+    k = np.searchsorted(index['t'], sec, side='left')
+    if k>=len(index) or index['t'][k]!=sec:
+        k -= 1         # 该秒没有数据块, 由之前最近的数据块推算
+    if k<0:
+        return -1
+    return int(index['block'][k]*data_size + round((us-index['t'][k]*1000000)/1000/dt))
+
  
+class MappedBlocks:
+    '''
+    np.memmap 上的数据块视图, 取值时才把count转换为电压
+
+    counts : np.array(int32), [N_CHN, N_BLOCK, data_size] 的跨步视图
+    scale  : count到电压的系数, COUNT2V*DB_FACTOR[DB]
+    dtype  : 输出数据流的格式
+
+    eg: data[0, 100:160] 只读取并缩放第0通道的60个数据块; np.asarray(data) 读取全部
+    '''
+
+    def __init__(self, counts, scale, dtype=np.float32):
+        self.counts = counts
+        self.scale  = scale
+        self.dtype  = np.dtype(dtype)
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @property
+    def ndim(self):
+        return self.counts.ndim
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, idx):
+        # 与read_bin_multiple_chn的缩放方式一致, 保证数值相同
+        return (self.counts[idx]*self.scale).astype(self.dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[...]
+        return data if dtype is None else data.astype(dtype)
+
+    def scale_into(self, out:np.array) -> np.array:
+        '''
+        缩放全部数据块并写入out(原位, 按块分段转换, 不生成整块的float64临时数组),
+        out 为整数类型时直接复制count
+
+        out: [N_CHN, N_BLOCK, data_size] 或可广播到该尺寸的数组视图
+        '''
+        if out.dtype.kind in 'iu':
+            np.copyto(out, self.counts)
+        else:
+            np.multiply(self.counts, self.scale, out=out)
+        return out
+
+
 def read_bin_multiple_chn(file_name, dt=1, DB=0,
              dtype=np.float32,FTYPE=np.int32,
-             block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE)-> tuple:
+             block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE,
+             mmap=False, raw=None, cache=None)-> tuple:
     '''
     读取GDST仪器二进制文件, 多通道文件
 
@@ -84,17 +241,42 @@ def read_bin_multiple_chn(file_name, dt=1, DB=0,
     block_size :  单个数据块尺寸，默认512 # float32
     data_size  :  单个数据块数据尺寸，默认500 # float32
     header_size:  单个数据块头文件尺寸，默认12 # float32
+    mmap     : 是否以np.memmap方式只读映射文件, 此时数据流为MappedBlocks(延迟缩放),
+               内部头文件为memmap上的视图, 不复制数据
+    raw      : 已读入的文件内容(FTYPE, [N_BLOCK, block_size]), eg: prefetch_bins 的输出,
+               提供时不再读取文件; 头文件(及mmap时的数据流)为raw上的视图
+    cache    : BinCache, None 为全局缓存(见enable_bin_cache), False 为不使用;
+               命中时返回缓存中的只读数组, mmap或提供raw时不使用缓存
 
     output:[头文件 1d, 数据流([N_CHN, NB, data_size]), 内部头文件[N_CHN,header_size]]
     '''
 
-    with open(file_name, 'rb') as f:
-        data_int = np.fromfile(f, dtype=FTYPE)
-    # data_float = np.zeros(data_int.shape, dtype=dtype)
-    
+    cache = None if mmap or raw is not None else bin_cache(cache)
+    if cache is not None:
+        key = cache.key(file_name, 'multiple_chn', dt, DB, np.dtype(dtype).str, np.dtype(FTYPE).str,
+                        block_size, data_size, header_size)
+        out = cache.get(key)
+        if out is None:
+            f_header, data_float, headers = read_bin_multiple_chn(file_name, dt, DB, dtype=dtype, FTYPE=FTYPE,
+                block_size=block_size, data_size=data_size, header_size=header_size, cache=False)
+            # 头文件是整个文件内容上的视图, 复制后不必保留整个文件
+            out = cache.put(key, (f_header.copy(), data_float, headers.copy()))
+        return out
+
     BS,DS, HS = block_size,data_size,header_size
 
-    N_BLOCK = len(data_int)//BS
+    if raw is not None:
+        data_int = raw
+        N_BLOCK = data_int.size//BS
+    elif mmap:
+        N_BLOCK = os.path.getsize(file_name)//np.dtype(FTYPE).itemsize//BS
+        data_int = np.memmap(file_name, dtype=FTYPE, mode='r', shape=(N_BLOCK, BS))
+    else:
+        with open(file_name, 'rb') as f:
+            data_int = np.fromfile(f, dtype=FTYPE)
+        N_BLOCK = len(data_int)//BS
+    # data_float = np.zeros(data_int.shape, dtype=dtype)
+
     N_DATA = int(7200/dt)
     assert DS*dt/1000*N_DATA==3600 # 一小时
     N_CHN = N_BLOCK//N_DATA #通道数检测
@@ -104,11 +286,18 @@ def read_bin_multiple_chn(file_name, dt=1, DB=0,
     data_int = data_int.reshape([N_BLOCK, HS+DS])
     # 头文件
     f_header = data_int[0,:]
-    # 数据流
-    data_float = data_int[1:N_DATA*N_CHN+1,HS:HS+DS]*COUNT2V*DB_FACTOR[DB]
-    data_float = data_float.astype(dtype)
-    data_float = data_float.reshape([N_DATA, N_CHN,DS])
-    data_float = np.transpose(data_float,[1,0,2])
+
+    if mmap:
+        counts = data_int[1:N_DATA*N_CHN+1,HS:HS+DS].reshape([N_DATA, N_CHN,DS])
+        data_float = MappedBlocks(np.transpose(counts,[1,0,2]), COUNT2V*DB_FACTOR[DB], dtype=dtype)
+        headers = data_int[1:N_DATA*N_CHN+1,:HS].reshape([N_DATA, N_CHN,HS])
+        headers = np.transpose(headers,[1,0,2])
+        return f_header, data_float, headers
+
+    # 数据流, 一次缩放直接写入连续的 [N_CHN, N_DATA, DS] 输出(与先乘后astype的数值相同)
+    counts = data_int[1:N_DATA*N_CHN+1,HS:HS+DS].reshape([N_DATA, N_CHN,DS])
+    data_float = np.empty([N_CHN, N_DATA, DS], dtype=dtype)
+    np.multiply(np.transpose(counts,[1,0,2]), COUNT2V*DB_FACTOR[DB], out=data_float, casting='unsafe')
 
     # block头文件
     headers = data_int[1:N_DATA*N_CHN+1,:HS]
@@ -117,35 +306,91 @@ def read_bin_multiple_chn(file_name, dt=1, DB=0,
     
     return f_header, data_float, headers
 
+def block_health(headers:np.array, dt=1, date=None, data_size=DATA_SIZE, tol=None) -> np.array:
+    '''
+    按数据块判断是否正常采集, 对所有数据块头文件一次性计算
+
+    未采集: 日期为0或不等于date
+    时间不连续: 块头时间与按块序号推算的时间相差超过tol,
+               推算时间的起点为 (块头时间-块序号*块时长) 的中位数
+    序号不连续: seq1 为递增计数时(相邻块差值的中位数>0), 未比前一块增加(重复或倒退)
+
+    headers  : np.array(int32), [..., N_BLOCK, header_size], eg: [N_CHN, N_BLOCK, 12]
+    dt       : 采样率，单位ms
+    date     : 文件日期 YYMMDD(int), None则不检查日期是否一致
+    data_size: 单个数据块数据尺寸，默认500
+    tol      : 允许的时间误差(s), 默认一个数据块的时长
+
+    out: bool, [..., N_BLOCK], True为正常
+    '''
+    shape = headers.shape[:-1]
+    rows  = (-1, shape[-1])
+    date_UTC, time_UTC, _, _, seq1, _ = bheader_decode_all(headers)
+    date_UTC = date_UTC.reshape(rows)
+    time_UTC = time_UTC.reshape(rows)
+    seq1     = seq1.reshape(rows)
+
+    T_BLOCK = data_size*dt/1000
+    if tol is None:
+        tol = T_BLOCK
+
+    ok = date_UTC>0
+    if date is not None:
+        ok &= date_UTC==int(date)
+
+    # 时间连续性, 以一天内的秒数计算
+    sod = (time_UTC//10000)*3600 + (time_UTC//100%100)*60 + time_UTC%100
+    k = np.arange(shape[-1])*T_BLOCK
+    offset = np.where(ok, sod-k, np.nan)
+    ref = np.zeros([len(ok), 1])
+    has = ok.any(axis=-1)
+    ref[has,0] = np.nanmedian(offset[has], axis=-1)
+    diff = (sod-k-ref+43200)%86400-43200
+    ok &= np.abs(diff)<=tol
+
+    # 序号连续性
+    d_seq = np.diff(seq1, axis=-1)
+    if d_seq.shape[-1]>0:
+        counting = np.median(d_seq, axis=-1, keepdims=True)>0
+        ok[:,1:] &= (d_seq>0) | ~counting
+
+    return ok.reshape(shape)
+
 def fill_empty_block(data_float:np.array, headers:np.array,
-                     fill_value=0
+                     fill_value=0, dt=1, date=None
                     )-> tuple:
     '''
+    对未采集或时间/序号不连续的数据块填充fill_value, 判断方式见block_health
+
     data_float: 3D data, N_CHN*N_block*data_size
     headers   : 3D data, N_CHN*N_block*header_size
     fill_value: 对未采样部分的填充数值
+    dt        : 采样率，单位ms
+    date      : 文件日期 YYMMDD(int), None则不检查日期
 
-    output    : 2D data_float filled with 0, N_CHN*(N_block*data_size)
+    output    : 3D data_float (原位修改), N_CHN*N_block*data_size
     '''
 
     nc, nb, nd = data_float.shape
-    _,  _,  nh = headers.shape
-    print('not finished')
+    ok = block_health(headers, dt=dt, date=date, data_size=nd)
+    data_float[~ok] = fill_value
     
     return data_float
 
 def read_bin(file_name, dt=1, DB=0,
              IS_Z_CHN = False,
-             fill_value=None, 
+             fill_value=None, date=None,
              dtype=np.float32,FTYPE=np.int32,
-             block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE)-> tuple:
+             block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE,
+             mmap=False, raw=None, cache=None)-> tuple:
     '''
     读取GDST仪器二进制文件
 
     file_name: 文件名
     dt       : 采样率，单位ms
     DB       : 增益率,仅 0, 6 18,24可选
-    fill_value: 关机没采集部分的填充格式
+    fill_value: 关机没采集部分的填充格式, 按数据块判断, 见fill_empty_block
+    date     : 文件日期 YYMMDD, 用于fill_value; None则由文件名 YYMMDDHH.BIN 得到
     IS_Z_CHN : 是否为单分量仪器,是则数据维度不再有CHN维度
 
     dtype    : 输出数据流的格式
@@ -153,18 +398,46 @@ def read_bin(file_name, dt=1, DB=0,
     block_size :  单个数据块尺寸，默认512 # float32
     data_size  :  单个数据块数据尺寸，默认500 # float32
     header_size:  单个数据块头文件尺寸，默认12 # float32
+    mmap     : 以np.memmap只读映射, 数据流保持[N_CHN, N_BLOCK, data_size]的MappedBlocks,
+               不支持fill_value
+    raw      : 已读入的文件内容, 见read_bin_multiple_chn
+    cache    : BinCache, None 为全局缓存(见enable_bin_cache), False 为不使用;
+               键包含文件路径、修改时间、大小及所有读取参数, 命中时返回缓存中的只读数组
 
     output:(头文件, 数据流, 内部头文件)
     '''
 
+    cache = None if mmap or raw is not None else bin_cache(cache)
+    if cache is not None:
+        key = cache.key(file_name, 'read_bin', dt, DB, IS_Z_CHN, fill_value, date, np.dtype(dtype).str,
+                        np.dtype(FTYPE).str, block_size, data_size, header_size)
+        out = cache.get(key)
+        if out is None:
+            f_header, data_float, headers = read_bin(file_name, dt, DB, IS_Z_CHN=IS_Z_CHN,
+                fill_value=fill_value, date=date, dtype=dtype, FTYPE=FTYPE, block_size=block_size,
+                data_size=data_size, header_size=header_size, cache=False)
+            out = cache.put(key, (f_header.copy(), data_float, headers.copy()))
+        return out
+
     f_header, data_float, headers = \
         read_bin_multiple_chn(file_name, dt, DB,
              dtype=dtype,FTYPE=FTYPE,
-             block_size = block_size, data_size = data_size, header_size=header_size)
+             block_size = block_size, data_size = data_size, header_size=header_size,
+             mmap=mmap, raw=raw, cache=False)
+
+    if mmap:
+        assert fill_value is None # 映射模式不修改数据
+        if IS_Z_CHN:
+            data_float = MappedBlocks(np.squeeze(data_float.counts,axis=0), data_float.scale, dtype=dtype)
+            headers = np.squeeze(headers,axis=0)
+        return f_header, data_float, headers
 
     # 对没采集状态填充
     if fill_value is not None:
-        data_float = fill_empty_block(data_float, headers,fill_value=fill_value)
+        if date is None:
+            base = os.path.basename(file_name)
+            date = int(base[:6]) if base[:8].isdigit() else None
+        data_float = fill_empty_block(data_float, headers,fill_value=fill_value, dt=dt, date=date)
         
     nc,nb,nd = data_float.shape
     data_float = data_float.reshape([nc, nb*nd])
@@ -195,4 +468,291 @@ def read_header(file_name, dt=1,
         data_int = np.fromfile(f, count=block_size, dtype=FTYPE)
     
     return data_int
-    
\ No newline at end of file
+
+def read_bheaders(file_name, dt=1, step=1, FTYPE=np.int32,
+                  block_size = BLOCK_SIZE, header_size=BLOCK_SIZE-DATA_SIZE) -> np.array:
+    '''
+    只读取GDST仪器二进制文件的数据块头文件, 文件以mmap映射, 只复制每个数据块的前header_size个数
+
+    file_name: 文件名
+    dt       : 采样率，单位ms
+    step     : 每隔step个数据块(时间方向)读取一个, >1时按随机访问映射, 不预读中间的数据
+    FTYPE    : 文件内部格式
+    block_size :  单个数据块尺寸，默认512
+    header_size:  单个数据块头文件尺寸，默认12
+
+    output: 内部头文件 [N_CHN, ceil(N_DATA/step), header_size]
+    '''
+    BS, HS = block_size, header_size
+    N_DATA = int(7200/dt)
+    N_BLOCK = os.path.getsize(file_name)//np.dtype(FTYPE).itemsize//BS
+    N_CHN = max(N_BLOCK-1, 0)//N_DATA
+    if N_CHN==0:
+        return np.zeros([0, 0, HS], dtype=FTYPE)
+
+    with open(file_name, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if step>1 and hasattr(mm, 'madvise'):
+            mm.madvise(mmap.MADV_RANDOM)
+        data_int = np.frombuffer(mm, dtype=FTYPE, count=(N_DATA*N_CHN+1)*BS).reshape([-1, BS])
+        headers = data_int[1:, :HS].reshape([N_DATA, N_CHN, HS])[::step]
+        headers = np.transpose(headers, [1,0,2]).copy()
+        del data_int # 关闭mmap前释放其上的视图
+    return headers
+    
+
+def _read_into(file_name, buffer, FTYPE=np.int32, block_size=BLOCK_SIZE) -> tuple:
+    # 把文件读入buffer(不够大时重新分配), 返回 ([N_BLOCK, block_size]的视图, buffer)
+    n = os.path.getsize(file_name)//np.dtype(FTYPE).itemsize
+    if buffer is None or buffer.size<n:
+        buffer = np.empty(n, dtype=FTYPE)
+    view = buffer[:n].view(np.uint8)
+    with open(file_name, 'rb', buffering=0) as f:
+        pos = 0
+        while pos<view.size:
+            k = f.readinto(view[pos:])
+            if not k:
+                break
+            pos += k
+    N_BLOCK = pos//np.dtype(FTYPE).itemsize//block_size
+    return buffer[:N_BLOCK*block_size].reshape([N_BLOCK, block_size]), buffer
+
+def prefetch_bins(files, depth=2, workers=None, FTYPE=np.int32, block_size=BLOCK_SIZE):
+    '''
+    按顺序迭代小时文件, 后台线程预读之后的depth个文件到可复用的缓冲区, 读取与计算重叠
+
+    files    : 文件名 list, 缺失的文件为None
+    depth    : 预读的文件数, 0 则在当前线程中逐个读取
+    workers  : 读取线程数, 默认为depth
+    FTYPE    : 文件内部格式
+    block_size :  单个数据块尺寸，默认512
+
+    yield: (文件名, raw), raw 为 [N_BLOCK, block_size] 的文件内容, 可传给 read_bin(raw=raw);
+           缺失的文件 raw 为None. 共depth+1个缓冲区轮流使用, raw 只在取下一个文件前有效
+
+    eg:
+        for file, raw in prefetch_bins(files, depth=4):
+            H, data, hs = read_bin(file, dt=2, raw=raw)
+    '''
+    if depth<=0:
+        buffer = None
+        for file in files:
+            if file is None:
+                yield file, None
+                continue
+            raw, buffer = _read_into(file, buffer, FTYPE=FTYPE, block_size=block_size)
+            yield file, raw
+        return
+
+    def read(file, buffer):
+        if file is None:
+            return None, buffer
+        return _read_into(file, buffer, FTYPE=FTYPE, block_size=block_size)
+
+    free = [None]*(depth+1)
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=workers or depth) as pool:
+        pending = deque()
+        def submit():
+            for file in files:
+                pending.append((file, pool.submit(read, file, free.pop())))
+                return
+
+        for _ in range(depth):
+            submit()
+        while pending:
+            file, future = pending.popleft()
+            raw, buffer = future.result()
+            yield file, raw
+            # 使用者已处理完raw, 缓冲区可再次使用
+            free.append(buffer)
+            submit()
+
+class BinFollower:
+    '''
+    跟踪正在写入的BIN文件, 每次只读取和解码新写完的数据块
+
+    数据块按时间、通道交错写入, 只输出所有通道都已写完的数据块(一行N_CHN个),
+    未写完的一行留到下一次读取
+
+    file_name: 文件名
+    N_CHN    : 通道数, 未写完的文件无法由文件大小判断
+    dt       : 采样率，单位ms
+    DB       : 增益率,仅 0, 6 18,24可选
+    dtype    : 输出数据流的格式
+    FTYPE    : 文件内部格式
+    block_size, data_size, header_size: 见read_bin
+
+    属性:
+    f_header : 文件头(写完2048字节后才有), 否则为None
+    offset   : 已读取到的字节位置
+    n_block  : 每个通道已输出的数据块数
+
+    eg:
+        follower = BinFollower('./A0000102/24052808.BIN', N_CHN=3, dt=2)
+        for data, headers in follower.follow(interval=1, timeout=60):
+            ...  # data: [N_CHN, n*500], headers: [N_CHN, n, 12]
+    '''
+
+    def __init__(self, file_name, N_CHN=1, dt=1, DB=0,
+                 dtype=np.float32, FTYPE=np.int32,
+                 block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE):
+        self.file_name = file_name
+        self.N_CHN = N_CHN
+        self.scale = COUNT2V*DB_FACTOR[DB]
+        self.dtype = dtype
+        self.FTYPE = FTYPE
+        self.BS, self.DS, self.HS = block_size, data_size, header_size
+        self.N_DATA = int(7200/dt)
+        assert self.DS*dt/1000*self.N_DATA==3600 # 一小时
+
+        self.f_header = None
+        self.offset  = 0
+        self.n_block = 0
+
+    @property
+    def complete(self) -> bool:
+        # 已读完一小时的所有数据块
+        return self.n_block>=self.N_DATA
+
+    def seek(self, n_block:int):
+        '''
+        从每个通道的第n_block个数据块继续读取, 用于中断后续写
+        '''
+        itemsize = np.dtype(self.FTYPE).itemsize
+        self.n_block = n_block
+        self.offset  = (1+n_block*self.N_CHN)*self.BS*itemsize
+
+    def poll(self) -> tuple:
+        '''
+        读取新写完的数据块
+
+        out: (数据流[N_CHN, n*data_size], 内部头文件[N_CHN, n, header_size]), 没有新数据时n=0
+        '''
+        BS, DS, HS, NC = self.BS, self.DS, self.HS, self.N_CHN
+        itemsize = np.dtype(self.FTYPE).itemsize
+        size = os.path.getsize(self.file_name) if os.path.exists(self.file_name) else 0
+
+        if self.f_header is None and size>=BS*itemsize:
+            self.f_header = np.fromfile(self.file_name, dtype=self.FTYPE, count=BS)
+            self.offset = max(self.offset, BS*itemsize)
+
+        n = 0
+        if self.f_header is not None:
+            n = min((size-self.offset)//(NC*BS*itemsize), self.N_DATA-self.n_block)
+        if n<=0:
+            return np.zeros([NC, 0], dtype=self.dtype), np.zeros([NC, 0, HS], dtype=self.FTYPE)
+
+        blocks = np.fromfile(self.file_name, dtype=self.FTYPE, count=n*NC*BS, offset=self.offset)
+        blocks = np.transpose(blocks.reshape([n, NC, BS]), [1,0,2])
+        self.offset  += n*NC*BS*itemsize
+        self.n_block += n
+
+        data = (blocks[:,:,HS:HS+DS]*self.scale).astype(self.dtype).reshape([NC, n*DS])
+        return data, blocks[:,:,:HS]
+
+    def follow(self, interval=1.0, timeout=None):
+        '''
+        每interval秒检查一次文件, yield 新的 (数据流, 内部头文件);
+        读完一小时的数据块, 或超过timeout秒没有新数据时结束
+
+        interval : 检查间隔, s
+        timeout  : 没有新数据的最长等待时间, s, None为一直等待
+        '''
+        last = time.time()
+        while not self.complete:
+            data, headers = self.poll()
+            if headers.shape[1]>0:
+                last = time.time()
+                yield data, headers
+                continue
+            if timeout is not None and time.time()-last>timeout:
+                return
+            time.sleep(interval)
+
+def _to_datetime64(t) -> np.datetime64:
+    # 支持 datetime, UTCDateTime, np.datetime64, 字符串
+    t = getattr(t, 'datetime', t)
+    return np.datetime64(t, 'us')
+
+def read_window(station_dir, t0, t1, dt=1, DB=0, channels=None,
+                fill_value=0,
+                dtype=np.float32,FTYPE=np.int32,
+                block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE)-> tuple:
+    '''
+    读取任意时间窗 [t0, t1) 的数据, 只读取覆盖该时间窗的数据块, 可跨小时文件
+
+    station_dir: 台站文件夹, 内含 {YYMMDDHH}.BIN
+    t0, t1     : 开始/结束时间(UTC), datetime, UTCDateTime 或 np.datetime64
+    dt         : 采样率，单位ms
+    DB         : 增益率,仅 0, 6 18,24可选
+    channels   : 所需通道, 序号或名称 eg: [0, 2] 或 'EZ', 默认全部
+    fill_value : 缺失小时文件的填充数值
+
+    dtype    : 输出数据流的格式
+    FTYPE    : 文件内部格式
+    block_size :  单个数据块尺寸，默认512 # float32
+    data_size  :  单个数据块数据尺寸，默认500 # float32
+    header_size:  单个数据块头文件尺寸，默认12 # float32
+
+    output:(数据流[n_chn, nt], 内部头文件[n_chn, n_block, header_size],
+            每个数据块开始时间 datetime64[us] [n_block], 第一个采样点时间 datetime64[us])
+    时间窗内没有文件且未指定channels时 raise FileNotFoundError
+    '''
+    BS,DS, HS = block_size,data_size,header_size
+    N_DATA = int(7200/dt)
+    assert DS*dt/1000*N_DATA==3600 # 一小时
+    itemsize = np.dtype(FTYPE).itemsize
+
+    dt_us = int(round(dt*1000))
+    t0 = _to_datetime64(t0)
+    t1 = _to_datetime64(t1)
+    i_start = (t0-np.datetime64('2000-01-01','us')).astype(np.int64)//dt_us            # 第一个采样点
+    i_end   = -(-(t1-np.datetime64('2000-01-01','us')).astype(np.int64)//dt_us)       # 最后一个采样点之后
+    NT_ahour = N_DATA*DS
+
+    pieces, headers, block_times = [], [], []
+    N_CHN, chn_idx = None, None
+    missing = []
+    for hour in range(i_start//NT_ahour, (i_end-1)//NT_ahour+1):
+        hour_start = np.datetime64('2000-01-01','us')+np.timedelta64(hour*NT_ahour*dt_us, 'us')
+        i0 = max(i_start-hour*NT_ahour, 0)
+        i1 = min(i_end-hour*NT_ahour, NT_ahour)
+        b0, b1 = i0//DS, -(-i1//DS)
+        block_times.append(hour_start+np.arange(b0, b1)*np.timedelta64(DS*dt_us, 'us'))
+
+        file_name = f"{station_dir}/{hour_start.astype(object).strftime('%y%m%d%H')}.BIN"
+        if not os.path.exists(file_name):
+            missing.append((len(pieces), b1-b0, i1-i0))
+            pieces.append(None)
+            headers.append(None)
+            continue
+
+        if N_CHN is None:
+            N_CHN = os.path.getsize(file_name)//itemsize//BS//N_DATA
+            chn_idx = list(range(N_CHN)) if channels is None else \
+                      [CHN_DEF[N_CHN].index(c) if isinstance(c, str) else c for c in channels]
+
+        # 该小时内 b0..b1 所有通道的数据块是连续的
+        offset = (1+b0*N_CHN)*BS*itemsize
+        blocks = np.fromfile(file_name, dtype=FTYPE, count=(b1-b0)*N_CHN*BS, offset=offset)
+        blocks = blocks.reshape([b1-b0, N_CHN, BS])[:, chn_idx, :]
+        blocks = np.transpose(blocks, [1,0,2])
+
+        data_i = (blocks[:,:,HS:HS+DS]*COUNT2V*DB_FACTOR[DB]).astype(dtype)
+        data_i = data_i.reshape([len(chn_idx), -1])[:, i0-b0*DS:i1-b0*DS]
+        pieces.append(data_i)
+        headers.append(blocks[:,:,:HS])
+
+    if N_CHN is None and channels is None:
+        raise FileNotFoundError(f'no file in the window: {station_dir}')
+    n_chn = len(chn_idx) if chn_idx is not None else len(channels)
+    for k, nb, nt in missing:
+        pieces[k]  = np.full([n_chn, nt], fill_value, dtype=dtype)
+        headers[k] = np.zeros([n_chn, nb, HS], dtype=FTYPE)
+
+    data = np.concatenate(pieces, axis=1)
+    headers = np.concatenate(headers, axis=1)
+    block_times = np.concatenate(block_times)
+    t_first = np.datetime64('2000-01-01','us')+np.timedelta64(int(i_start*dt_us), 'us')
+
+    return data, headers, block_times, t_first
@@ -0,0 +1,96 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class ConvertStats:
+    '''
+    转换过程的分阶段计时和计数, 可传给所有转换函数的 stats 参数
+
+    阶段(stage): read(读文件; 后台预读时为等待读取完成的时间), decode(解码文件结构及缩放), header(块头解码/健康度), health(置零),
+                decimate(降采样), qc(QC统计), write(写h5/sac)
+    计数(counters): 每个台站的 missing_minutes(缺失的小时文件), unhealthy_minutes(不健康的数据块)等
+
+    callback: 每个阶段结束时调用 callback(record), record 为
+              {'stage':, 'station':, 'hour':, 'time':(s), 'bytes':}
+
+    eg:
+        stats = ConvertStats()
+        bins2h5_day(..., stats=stats)
+        stats.to_json('stats.json')
+    '''
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.records  = []
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, stage:str, station=None, hour=None, nbytes=0):
+        '''
+        记录一个阶段的耗时, with 语句内可修改 record['bytes']
+        '''
+        record = {'stage': stage, 'station': station, 'hour': hour, 'bytes': int(nbytes)}
+        t = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = time.perf_counter()-t
+            self.add(record)
+
+    def add(self, record:dict):
+        record['bytes'] = int(record.get('bytes', 0))
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def count(self, name:str, value=1, station=None):
+        '''
+        累加计数
+        '''
+        counters = self.counters.setdefault(station, {})
+        counters[name] = counters.get(name, 0)+value
+
+    def merge(self, other:dict):
+        '''
+        合并另一个 ConvertStats.to_dict() 的结果, 用于汇总子进程的统计
+        '''
+        for record in other['records']:
+            self.add(dict(record))
+        for station, counters in other['counters'].items():
+            for name, value in counters.items():
+                self.count(name, value, station=station)
+
+    def summary(self) -> dict:
+        '''
+        按阶段汇总: {stage: {'time':, 'bytes':, 'n':, 'MB/s':}}
+        '''
+        out = {}
+        for record in self.records:
+            s = out.setdefault(record['stage'], {'time': 0.0, 'bytes': 0, 'n': 0})
+            s['time']  += record['time']
+            s['bytes'] += record['bytes']
+            s['n']     += 1
+        for s in out.values():
+            s['MB/s'] = s['bytes']/1e6/s['time'] if s['time']>0 else 0.0
+        return out
+
+    def to_dict(self) -> dict:
+        return {
+            'stages'  : self.summary(),
+            'records' : self.records,
+            'counters': self.counters,
+        }
+
+    def to_json(self, file_name=None, indent=None) -> str:
+        '''
+        转换为json字符串, 提供file_name时同时写入文件
+        '''
+        d = self.to_dict()
+        # json 的键必须为字符串
+        d['counters'] = {str(k): v for k, v in d['counters'].items()}
+        text = json.dumps(d, indent=indent, default=float)
+        if file_name is not None:
+            with open(file_name, 'w') as f:
+                f.write(text)
+        return text
@@ -43,3 +43,6 @@ CHN_DEF={
 BLOCK_SIZE = 512 # int32
 DATA_SIZE = 500 # int32
 
+
+# 削波判断: 绝对值不小于满量程(2**31 count)的CLIP_LEVEL倍
+CLIP_LEVEL = 0.99
@@ -0,0 +1,110 @@
+import numpy as np
+from functools import lru_cache
+# scipy.signal 在函数中导入, import pygdst 时不加载
+
+# 转换过程中顺带计算的质量检查(QC)统计: 每分钟的RMS、最大绝对值、削波采样点数, 每小时的功率谱密度
+# 均按小时分段计算, 中间结果只占一小时数据的内存
+
+QC_KEYS = ['rms', 'max', 'clipped', 'psd']
+
+
+def qc_nperseg(dt) -> int:
+    '''
+    PSD 每段的采样点数, 约30s, 取2的幂
+    '''
+    return int(2**np.ceil(np.log2(30/dt)))
+
+
+@lru_cache(maxsize=16)
+def qc_freq_bins(dt, nperseg, n_freq=64) -> tuple:
+    '''
+    把Welch PSD的线性频率合并为对数间隔的频带: 频带内有频点时取平均,
+    没有频点(低频端)时在频带中心线性插值, 用一次矩阵乘法完成
+
+    dt      : 采样间隔, 单位s
+    nperseg : PSD 每段的采样点数
+    n_freq  : 频带数, 从 1/(nperseg*dt) 到 0.5/dt
+
+    out: (频带中心频率 [n_freq], 权重 [nperseg//2+1, n_freq])
+    '''
+    f = np.fft.rfftfreq(nperseg, dt)
+    edges = np.geomspace(f[1], f[-1], n_freq+1)
+    center = np.sqrt(edges[:-1]*edges[1:])
+
+    W = np.zeros([len(f), n_freq])
+    for b in range(n_freq):
+        inside = np.flatnonzero((f>=edges[b]) & (f<edges[b+1] if b<n_freq-1 else f<=edges[b+1]))
+        if len(inside):
+            W[inside, b] = 1/len(inside)
+        else:
+            i = np.searchsorted(f, center[b])-1
+            W[i, b]   = (f[i+1]-center[b])/(f[i+1]-f[i])
+            W[i+1, b] = (center[b]-f[i])/(f[i+1]-f[i])
+    W.setflags(write=False)
+    return center, W
+
+
+def qc_stats(data:np.array, dt, clip=np.inf, nperseg=None, n_freq=64) -> dict:
+    '''
+    计算质量检查统计, 按小时分段; 分钟统计对所有通道一次性计算, PSD逐道计算
+
+    data    : np.array, [..., nt], nt 为整小时, eg: 一小时 [N_CHN, 3600/dt] 或一天
+    dt      : 采样间隔, 单位s
+    clip    : 削波阈值(与data同单位), 绝对值不小于clip的采样点计为削波
+    nperseg : PSD 每段的采样点数, 默认约30s(qc_nperseg), 50%重叠, Hann窗
+    n_freq  : PSD 的对数频带数, 见qc_freq_bins
+
+    out: {'rms'     : [..., n_minute] float32, 每分钟的均方根,
+          'max'     : [..., n_minute] float32, 每分钟的最大绝对值,
+          'clipped' : [..., n_minute] float32, 每分钟削波的采样点数,
+          'psd'     : [..., n_hour, n_freq] float32, 每小时的功率谱密度(单位^2/Hz),
+          'freq'    : [n_freq] 频带中心频率}
+    '''
+    from scipy.signal import welch
+
+    NT_amin  = int(round(60/dt))
+    NT_ahour = 60*NT_amin
+    nt = data.shape[-1]
+    assert nt%NT_ahour==0
+    nperseg = qc_nperseg(dt) if nperseg is None else nperseg
+    _, W = qc_freq_bins(dt, nperseg, n_freq)
+
+    lead = data.shape[:-1]
+    out = qc_empty(lead, nt//NT_ahour, dt, nperseg, n_freq)
+    psd = out['psd'].reshape([-1, nt//NT_ahour, n_freq])
+    for h in range(nt//NT_ahour):
+        x = data[..., h*NT_ahour:(h+1)*NT_ahour]
+        m = x.reshape(lead+(60, NT_amin))
+        ms = slice(h*60, (h+1)*60)
+        out['rms'][..., ms]     = np.sqrt(np.mean(np.square(m, dtype=np.float64), axis=-1))
+        out['max'][..., ms]     = np.maximum(m.max(axis=-1), -m.min(axis=-1))
+        out['clipped'][..., ms] = np.count_nonzero((m>=clip) | (m<=-clip), axis=-1)
+        # 逐道计算, 分段的中间结果只占一道一小时数据的几倍
+        for k, x_k in enumerate(x.reshape([-1, NT_ahour])):
+            _, p = welch(x_k, fs=1/dt, nperseg=nperseg)
+            psd[k, h] = p@W
+    return out
+
+
+def qc_empty(lead, n_hour, dt, nperseg=None, n_freq=64) -> dict:
+    '''
+    没有数据的小时的QC统计, 全部为nan; lead 为数据除时间外的尺寸, eg: (N_CHN,)
+    '''
+    lead = tuple(lead)
+    nperseg = qc_nperseg(dt) if nperseg is None else nperseg
+    return {
+        'freq'   : qc_freq_bins(dt, nperseg, n_freq)[0],
+        'rms'    : np.full(lead+(60*n_hour,), np.nan, dtype='float32'),
+        'max'    : np.full(lead+(60*n_hour,), np.nan, dtype='float32'),
+        'clipped': np.full(lead+(60*n_hour,), np.nan, dtype='float32'),
+        'psd'    : np.full(lead+(n_hour, n_freq), np.nan, dtype='float32'),
+    }
+
+
+def qc_concatenate(hours:list) -> dict:
+    '''
+    按时间拼接逐小时的QC统计
+    '''
+    out = {key: np.concatenate([h[key] for h in hours], axis=-2 if key=='psd' else -1) for key in QC_KEYS}
+    out['freq'] = hours[0]['freq']
+    return out
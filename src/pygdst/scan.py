@@ -0,0 +1,162 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from .gdst import read_bheaders, bheader_table, bheader_time_index
+from .catalog import BIN_PATTERN, build_catalog, catalog_paths
+
+# 只读取数据块头文件的快速扫描: 台站位置、GPS锁定比例、首末时间和序号不连续的统计,
+# 不读取和转换数据, 用于布设后的质量检查报告
+
+# 每个文件一条记录(第0通道的块头)
+SCAN_DTYPE = np.dtype([
+    ('sn',       'S32'),
+    ('date',     'S6'),
+    ('hour',     'u1'),
+    ('n_chn',    'i2'),
+    ('n_block',  'i4'),   # 读取的数据块数(step>1时为抽样数)
+    ('n_empty',  'i4'),   # 未采集的数据块(日期为0)
+    ('n_locked', 'i4'),   # GPS锁定的数据块(lat, lon 均不为0)
+    ('lock',     'f8'),   # GPS锁定比例, n_locked/(n_block-n_empty)
+    ('lat',      'f8'),   # 锁定数据块的lat中位数, 无锁定时为nan
+    ('lon',      'f8'),
+    ('t_first',  'M8[s]'),# 第一个/最后一个有效块头时间(UTC)
+    ('t_last',   'M8[s]'),
+    ('seq_gaps', 'i4'),   # seq1 增量与典型增量不同的次数
+])
+
+# 每个台站一条记录, 由 SCAN_DTYPE 汇总
+STATION_SCAN_DTYPE = np.dtype([
+    ('sn',       'S32'),
+    ('n_files',  'i4'),
+    ('n_block',  'i8'),
+    ('n_empty',  'i8'),
+    ('n_locked', 'i8'),
+    ('lock',     'f8'),
+    ('lat',      'f8'),   # 各文件lat中位数的中位数
+    ('lon',      'f8'),
+    ('t_first',  'M8[s]'),
+    ('t_last',   'M8[s]'),
+    ('seq_gaps', 'i8'),
+])
+
+
+def _seq_gaps(seq1:np.array) -> int:
+    # seq1 为递增计数时, 相邻块的增量不等于典型增量(中位数)即为一次不连续
+    d_seq = np.diff(seq1.astype(np.int64))
+    if len(d_seq)==0:
+        return 0
+    typical = np.median(d_seq)
+    if typical<=0:
+        return 0
+    return int(np.count_nonzero(d_seq!=typical))
+
+
+def scan_bin(file_name, dt=0.002, step=1) -> np.void:
+    '''
+    只读取一个BIN文件的数据块头文件(见read_bheaders), 统计第0通道的块头
+
+    file_name: 文件名 {sn}/{YYMMDDHH}.BIN
+    dt       : 采样间隔, 单位s
+    step     : 每隔step个数据块读取一个, eg: dt=0.002时step=60为每分钟一个
+
+    out: SCAN_DTYPE 的一条记录
+    '''
+    r = np.zeros((), dtype=SCAN_DTYPE)
+    r['sn'] = os.path.basename(os.path.dirname(os.path.abspath(file_name)))
+    m = BIN_PATTERN.match(os.path.basename(file_name))
+    if m is not None:
+        r['date'], r['hour'] = m.group(1), int(m.group(2))
+    r['lat'] = r['lon'] = np.nan
+    r['t_first'] = r['t_last'] = np.datetime64('NaT')
+
+    hs = read_bheaders(file_name, dt=dt*1000, step=step)
+    r['n_chn'] = hs.shape[0]
+    if hs.size==0:
+        return r[()]
+
+    table = bheader_table(hs[0])
+    recorded = table['date']>0
+    locked = recorded & (table['lat']!=0) & (table['lon']!=0)
+    r['n_block']  = len(table)
+    r['n_empty']  = np.count_nonzero(~recorded)
+    r['n_locked'] = np.count_nonzero(locked)
+    r['lock']     = r['n_locked']/max(int(recorded.sum()), 1)
+    if locked.any():
+        r['lat'] = np.median(table['lat'][locked])
+        r['lon'] = np.median(table['lon'][locked])
+
+    index = bheader_time_index(table)
+    if len(index):
+        r['t_first'] = np.datetime64(int(index['t'][0]), 's')
+        r['t_last']  = np.datetime64(int(index['t'][-1]), 's')
+    r['seq_gaps'] = _seq_gaps(table['seq1'][recorded])
+    return r[()]
+
+
+def scan_stations(files:np.array) -> np.array:
+    '''
+    按台站汇总 scan_bin 的记录
+
+    files: SCAN_DTYPE 数组
+
+    out: STATION_SCAN_DTYPE 数组, 按仪器号排序
+    '''
+    sns = np.unique(files['sn'])
+    out = np.zeros(len(sns), dtype=STATION_SCAN_DTYPE)
+    for k, sn in enumerate(sns):
+        f = files[files['sn']==sn]
+        r = out[k]
+        r['sn'], r['n_files'] = sn, len(f)
+        for name in ['n_block', 'n_empty', 'n_locked', 'seq_gaps']:
+            r[name] = f[name].sum()
+        r['lock'] = r['n_locked']/max(int(r['n_block']-r['n_empty']), 1)
+        has = ~np.isnan(f['lat'])
+        r['lat'] = np.median(f['lat'][has]) if has.any() else np.nan
+        r['lon'] = np.median(f['lon'][has]) if has.any() else np.nan
+        t_first, t_last = f['t_first'][~np.isnat(f['t_first'])], f['t_last'][~np.isnat(f['t_last'])]
+        r['t_first'] = t_first.min() if len(t_first) else np.datetime64('NaT')
+        r['t_last']  = t_last.max() if len(t_last) else np.datetime64('NaT')
+    return out
+
+
+def scan_survey(ROOT_folder, dt=0.002, step=1, workers=16, catalog=None, dates=None) -> dict:
+    '''
+    在线程池中扫描整个测线的原始文件 ROOT_folder/{sn}/{date}{hour}.BIN, 只读取数据块头文件
+
+    ROOT_folder: 原始文件根目录
+    dt         : 采样间隔, 单位s
+    step       : 每隔step个数据块读取一个, 见scan_bin
+    workers    : 线程数
+    catalog    : build_catalog 生成的文件目录, 不提供则扫描ROOT_folder
+    dates      : 日期 YYMMDD list, None 为全部日期
+
+    out: {'files': SCAN_DTYPE 数组, 'stations': STATION_SCAN_DTYPE 数组}
+
+    eg:
+        report = scan_survey('./root', step=60)
+        scan2csv(report['stations'], 'stations.csv')
+    '''
+    if catalog is None:
+        catalog = build_catalog(ROOT_folder, dt=dt, workers=workers)
+    if dates is None:
+        paths = catalog_paths(catalog)
+    else:
+        paths = [path for date in dates for path in catalog_paths(catalog, date=date)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        files = list(pool.map(lambda path: scan_bin(path, dt=dt, step=step), paths))
+
+    files = np.array(files, dtype=SCAN_DTYPE)
+    return {'files': files, 'stations': scan_stations(files)}
+
+
+def scan2csv(records:np.array, file_name, M=','):
+    '''
+    把 scan_bin / scan_stations 的记录写入csv, 第一行为字段名
+    '''
+    with open(file_name, 'w') as f:
+        f.write(M.join(records.dtype.names)+'\n')
+        for r in records:
+            values = ['' if v is None else v.decode() if isinstance(v, bytes) else str(v) for v in r.tolist()]
+            f.write(M.join(values)+'\n')
@@ -0,0 +1,191 @@
+import os
+import numpy as np
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+from .gdst import read_window, block_health, _to_datetime64
+from .paras import DATA_SIZE
+
+# 多台站同一时间窗的数据读入共享内存 [n_station, n_chn, nt], 其他进程按名称attach, 不复制数据
+
+
+class SharedArray:
+    '''
+    multiprocessing.shared_memory 上的 np.ndarray
+
+    shape : 数组尺寸
+    dtype : 数据类型
+    name  : 共享内存名称, 提供且create=False时attach已有的共享内存
+    create: 是否新建
+
+    属性 data 为共享内存上的数组; spec() 可传给子进程, 用 SharedArray.attach(spec) 得到同一块内存
+    创建者用完后调用 unlink() 释放, 其他进程只调用 close()
+
+    eg:
+        with SharedArray((3, 1000)) as a:
+            a.data[:] = 1
+            pool.submit(work, a.spec())      # 子进程: SharedArray.attach(spec).data
+            a.unlink()
+    '''
+
+    def __init__(self, shape, dtype='float32', name=None, create=True):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(self.shape))*self.dtype.itemsize, 1)
+        self.shm  = shared_memory.SharedMemory(name=name, create=create, size=nbytes if create else 0)
+        self.name = self.shm.name
+        self.data = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def spec(self) -> dict:
+        return {'name': self.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    @classmethod
+    def attach(cls, spec:dict):
+        return cls(spec['shape'], spec['dtype'], name=spec['name'], create=False)
+
+    def close(self):
+        self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _window_health(headers:np.array, block_times:np.array, dt=1) -> np.array:
+    # 按小时文件分段计算健康度, 与逐文件调用 block_health 的 station_day 等一致
+    # (seq1 在每个文件中重新计数, 跨小时合并计算会把新文件的第一个数据块判为不正常)
+    hours = block_times.astype('datetime64[h]')
+    health = np.zeros(len(block_times), dtype=bool)
+    for hour in np.unique(hours):
+        sel = hours==hour
+        date = int(hour.astype(object).strftime('%y%m%d'))
+        health[sel] = block_health(headers[:, sel], dt=dt, date=date).all(axis=0)
+    return health
+
+
+def read_array_window(station_dirs:list, t0, t1, dt=1, DB=0, channels=None, fill_value=0,
+                      workers=8, names=None, dtype=np.float32) -> tuple:
+    '''
+    从原始BIN文件读取多个台站同一时间窗 [t0, t1) 的数据到共享内存, 各台站在线程池中并行读取
+
+    station_dirs: 台站文件夹 list, 内含 {YYMMDDHH}.BIN
+    t0, t1      : 开始/结束时间(UTC), datetime, UTCDateTime 或 np.datetime64
+    dt          : 采样率，单位ms
+    DB          : 增益率
+    channels    : 所需通道, 见read_window; 默认全部
+    fill_value  : 缺失部分的填充数值
+    workers     : 读取线程数
+    names       : 台站名 list, 默认为文件夹名
+
+    out: (SharedArray [n_station, n_chn, nt],
+          {'names':, 'health': 每个数据块的健康度 bool [n_station, n_block],
+           'block_times': 每个数据块开始时间 datetime64[us], 't_first': 第一个采样点时间, 'dt': s})
+    '''
+    names = [os.path.basename(os.path.normpath(d)) for d in station_dirs] if names is None else list(names)
+    ns = len(station_dirs)
+
+    # 由第一个有数据的台站确定通道数和时间轴
+    first = None
+    for i, station_dir in enumerate(station_dirs):
+        try:
+            first = (i, read_window(station_dir, t0, t1, dt=dt, DB=DB, channels=channels,
+                                    fill_value=fill_value, dtype=dtype))
+            break
+        except FileNotFoundError:
+            continue
+    if first is None:
+        raise FileNotFoundError('no file in the window')
+    i0, (data0, headers0, block_times, t_first) = first
+
+    out = SharedArray((ns,)+data0.shape, dtype=dtype)
+    out.data[:] = fill_value
+    health = np.zeros([ns, len(block_times)], dtype=bool)
+    chn = list(range(data0.shape[0])) if channels is None else channels
+
+    def read(i):
+        if i==i0:
+            data_i, headers_i = data0, headers0
+        else:
+            data_i, headers_i, _, _ = read_window(station_dirs[i], t0, t1, dt=dt, DB=DB, channels=chn,
+                                                  fill_value=fill_value, dtype=dtype)
+        out.data[i] = data_i
+        health[i] = _window_health(headers_i, block_times, dt=dt)
+
+    # 读取出错时释放共享内存, 不留在 /dev/shm
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(read, range(ns)))
+    except BaseException:
+        out.close()
+        out.unlink()
+        raise
+
+    meta = {'names': names, 'health': health, 'block_times': block_times, 't_first': t_first, 'dt': dt/1000}
+    return out, meta
+
+
+def read_h5_array_window(h5_name, t0, t1, names=None, fill_value=0) -> tuple:
+    '''
+    从 bins2h5_day 或 h5_virtual 的输出读取多个台站同一时间窗 [t0, t1) 的数据到共享内存,
+    每个台站直接读入共享内存(read_direct), 不经过中间数组
+
+    h5_name    : h5文件名
+    t0, t1     : 开始/结束时间(UTC)
+    names      : 台站名 list, 默认为文件中的全部台站
+    fill_value : 时间窗超出文件范围或台站不存在时的填充数值
+
+    out: (SharedArray [n_station, n_chn, nt],
+          {'names':, 'health': 健康度 [n_station, n_block], 'block_times':, 't_first':, 'dt': s})
+    '''
+    import h5py
+    from .convert import _h5_day_date
+
+    with h5py.File(h5_name, 'r') as f:
+        dt = float(f['dt'][()])
+        all_names = [n.decode() for n in f['names'][:]]
+        names = all_names if names is None else list(names)
+        if 'starttime' in f:
+            start = np.datetime64(f['starttime'][()].decode(), 'us')
+        else:
+            date = _h5_day_date(f)
+            start = np.datetime64(f'20{date[0:2]}-{date[2:4]}-{date[4:6]}', 'us')
+        virtual = 'data' in f and isinstance(f['data'], h5py.Dataset)
+        d0 = f['data'] if virtual else f[f'data/{all_names[0]}']
+        nc, nt_all = d0.shape[-2], d0.shape[-1]
+
+        us = np.timedelta64(1, 'us')
+        i_start = int(np.floor((_to_datetime64(t0)-start)/us*1e-6/dt))
+        i_end   = int(np.ceil((_to_datetime64(t1)-start)/us*1e-6/dt))
+        sp, ep = max(i_start, 0), min(i_end, nt_all)
+
+        out = SharedArray((len(names), nc, i_end-i_start), dtype=d0.dtype)
+        out.data[:] = fill_value
+
+        health_dt = float(f['health_dt'][()]) if 'health_dt' in f else DATA_SIZE*dt
+        b0 = int(np.floor(i_start*dt/health_dt))
+        b1 = int(np.ceil(i_end*dt/health_dt))
+        health = np.zeros([len(names), b1-b0], dtype='float32')
+        health_all = f['health']
+        nb_all = health_all.shape[1]
+
+        for i, name in enumerate(names):
+            if name not in all_names or ep<=sp:
+                continue
+            k = all_names.index(name)
+            dest = np.s_[:, sp-i_start:ep-i_start]
+            if virtual:
+                f['data'].read_direct(out.data[i], np.s_[k, :, sp:ep], dest)
+            else:
+                f[f'data/{name}'].read_direct(out.data[i], np.s_[:, sp:ep], dest)
+            health[i, max(-b0, 0):min(b1, nb_all)-b0] = health_all[k, max(b0, 0):min(b1, nb_all)]
+
+    block_times = start+np.arange(b0, b1)*np.timedelta64(int(round(health_dt*1e6)), 'us')
+    t_first = start+np.timedelta64(int(round(i_start*dt*1e6)), 'us')
+    meta = {'names': names, 'health': health, 'block_times': block_times, 't_first': t_first, 'dt': dt}
+    return out, meta
@@ -0,0 +1,117 @@
+import os
+import numpy as np
+from datetime import datetime, timedelta
+
+from .paras import BLOCK_SIZE, DATA_SIZE
+
+# 生成GDST仪器格式的模拟BIN文件, 用于测试和性能测试
+
+
+def deg2gdst(deg:float) -> int:
+    '''
+    十进制度转换为块头中的 ddmm.mmmm 整数格式(度*1e6+分*1e4), bheader_decode 的逆运算
+    '''
+    d = int(deg)
+    return d*1000000 + int(round((deg-d)*60*1e4))
+
+
+def make_bin(file_name, date='240528', hour=0, N_CHN=1, dt=0.002,
+             lat=39.9, lon=116.4, gaps=(), unlocked=(), amp=2**20, seed=0,
+             block_size = BLOCK_SIZE, data_size = DATA_SIZE, header_size=BLOCK_SIZE-DATA_SIZE) -> str:
+    '''
+    生成一个小时的模拟BIN文件
+
+    file_name: 文件名
+    date     : 日期 YYMMDD
+    hour     : 小时
+    N_CHN    : 通道数
+    dt       : 采样间隔, 单位s
+    lat, lon : 台站位置(度)
+    gaps     : 未采集的数据块序号(所有通道), 块头和数据均为0
+    unlocked : GPS未锁定的数据块序号, 块头中lat, lon为0
+    amp      : 数据幅值, count
+    seed     : 随机数种子
+
+    out: file_name
+    '''
+    BS, DS, HS = block_size, data_size, header_size
+    N_DATA = int(3600/dt/DS)
+    rng = np.random.default_rng(seed)
+
+    a = np.zeros([1+N_DATA*N_CHN, BS], dtype='int32')
+
+    # 文件头
+    a[0,:4] = [int(f'{date}{hour:02d}'), N_DATA*DS, deg2gdst(lat), deg2gdst(lon)]
+
+    # 数据: 随机游走的低频噪声 + 正弦信号
+    t = np.arange(N_DATA*DS)*dt
+    for c in range(N_CHN):
+        x = np.cumsum(rng.standard_normal(N_DATA*DS))
+        x = x-np.convolve(x, np.ones(101)/101, mode='same')
+        x = x/np.abs(x).max()*0.5 + 0.5*np.sin(2*np.pi*(1+c)*t)
+        a[1+c::N_CHN, HS:HS+DS] = (amp*x).astype('int32').reshape([N_DATA, DS])
+
+    # 块头: 与bheader_decode的字节定义一致
+    hb = a[1:, :HS].view('u1').reshape([N_DATA*N_CHN, HS*4])
+    t0 = datetime.strptime(date, '%y%m%d')+timedelta(hours=hour)
+    sec = (np.arange(N_DATA)*DS*dt).astype(int)
+    hb[:,18] = t0.year%100
+    hb[:,19] = t0.month
+    hb[:,20] = t0.day
+    hb[:,21] = t0.hour
+    hb[:,22] = np.repeat(sec//60, N_CHN)
+    hb[:,23] = np.repeat(sec%60, N_CHN)
+    a[1:,6] = deg2gdst(lat)
+    a[1:,7] = deg2gdst(lon)
+    a[1:,8] = np.arange(N_DATA*N_CHN)
+    a[1:,9] = np.repeat(sec, N_CHN)
+
+    for b in unlocked:
+        a[1+b*N_CHN:1+(b+1)*N_CHN, 6:8] = 0
+    for b in gaps:
+        a[1+b*N_CHN:1+(b+1)*N_CHN, :] = 0
+
+    a.tofile(file_name)
+    return file_name
+
+
+def make_survey(ROOT_folder, stations=2, dates=('240528',), hours=range(24), N_CHN=1, dt=0.002,
+                gap_fraction=0.0, missing_fraction=0.0, unlocked_fraction=0.0, seed=0) -> list:
+    '''
+    生成模拟的原始文件目录 ROOT_folder/{sn}/{date}{hour}.BIN
+
+    ROOT_folder: 原始文件根目录
+    stations   : 台站数, 或仪器号 list
+    dates      : 日期 YYMMDD list
+    hours      : 每天的小时 list
+    N_CHN      : 通道数, 1/3/4
+    dt         : 采样间隔, 单位s
+    gap_fraction     : 未采集的数据块比例(以连续一段注入)
+    missing_fraction : 缺失的小时文件比例
+    unlocked_fraction: GPS未锁定的数据块比例
+    seed       : 随机数种子
+
+    out: 生成的文件名 list
+    '''
+    rng = np.random.default_rng(seed)
+    if isinstance(stations, int):
+        stations = [f'A{i:07d}' for i in range(1, stations+1)]
+    N_DATA = int(3600/dt/DATA_SIZE)
+
+    files = []
+    for i, sn in enumerate(stations):
+        os.makedirs(f'{ROOT_folder}/{sn}', exist_ok=True)
+        lat, lon = 39.9+0.01*i, 116.4+0.01*i
+        for date in dates:
+            for hour in hours:
+                if rng.random()<missing_fraction:
+                    continue
+                n_gap = int(N_DATA*gap_fraction)
+                b0 = rng.integers(0, N_DATA-n_gap+1)
+                gaps = range(b0, b0+n_gap)
+                unlocked = np.flatnonzero(rng.random(N_DATA)<unlocked_fraction)
+                file_name = f'{ROOT_folder}/{sn}/{date}{hour:02d}.BIN'
+                files.append(make_bin(file_name, date=date, hour=hour, N_CHN=N_CHN, dt=dt,
+                                      lat=lat, lon=lon, gaps=gaps, unlocked=unlocked,
+                                      seed=int(rng.integers(2**31))))
+    return files
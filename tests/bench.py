@@ -0,0 +1,115 @@
+import sys
+import os
+import glob
+import time
+import shutil
+import argparse
+import resource
+import multiprocessing as mp
+sys.path.append('../src/')
+
+# 性能测试: 在模拟数据上测试各函数的吞吐量(MB/s)和峰值内存(RSS)
+# eg: python bench.py --chn 1 3 --hours 2 --stations 4 --dt 0.002
+
+
+def _status_mb(key):
+    # /proc/self/status 中的 VmRSS / VmHWM, MB
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(key):
+                return int(line.split()[1])/1024
+
+def _reset_peak_rss():
+    # linux: 向clear_refs写5可重置峰值RSS(VmHWM), 不计入import的内存
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status_mb('VmRSS')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+
+def _peak_rss():
+    try:
+        return _status_mb('VmHWM')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # ru_maxrss 单位为KB(linux)
+
+
+def _run(name, args, queue):
+    # 在独立的进程中运行, 峰值内存互不影响
+    import pygdst
+    from pygdst import read_bin, bheader2list, bins2sac, bins2h5, bins2h5_day
+    # pygdst 在函数内部才导入的依赖, 提前导入, 导入的时间和内存不计入结果
+    import obspy
+    import h5py
+    import scipy.signal
+    base = _reset_peak_rss()
+
+    t = time.time()
+    if name=='read_bin':
+        for file in args['files']:
+            read_bin(file, dt=args['dt']*1000)
+    elif name=='bheader2list':
+        for hs in args['headers']:
+            bheader2list(hs, interval=1)
+    elif name=='bins2sac':
+        bins2sac(args['files_sn'], f"{args['out']}/bench_{{CHN}}.sac", dt=args['dt'], name='bench',
+                 N_CHN=args['N_CHN'], DOWNSAMPLE_RATE=5)
+    elif name=='bins2h5':
+        bins2h5(args['files_sn'], f"{args['out']}/bench.h5", dt=args['dt'])
+    elif name=='bins2h5_day':
+        bins2h5_day(args['root'], f"{args['out']}/bench_day.h5", args['date'], header_file_pattern=None,
+                    N_CHN=args['N_CHN'], dt=args['dt'], DOWNSAMPLE_RATE=5)
+    t = time.time()-t
+
+    queue.put((t, _peak_rss()-base))
+
+
+def bench(name, args, nbytes):
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    p = ctx.Process(target=_run, args=(name, args, queue))
+    p.start()
+    t, rss = queue.get()
+    p.join()
+    print(f"{name:14s} {args['N_CHN']:4d} {nbytes/1e6:10.1f} {nbytes/1e6/t:10.1f} {t:8.2f} {rss:12.1f}", flush=True)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default='./bench_root')
+    parser.add_argument('--out', default='./out')
+    parser.add_argument('--chn', type=int, nargs='+', default=[1, 3])
+    parser.add_argument('--stations', type=int, default=2)
+    parser.add_argument('--hours', type=int, default=2)
+    parser.add_argument('--dt', type=float, default=0.002)
+    parser.add_argument('--keep', action='store_true', help='保留生成的模拟数据')
+    opts = parser.parse_args()
+
+    from pygdst import read_bin
+    from pygdst.synth import make_survey
+
+    date = '240528'
+    os.makedirs(opts.out, exist_ok=True)
+    print(f"{'function':14s} {'chn':>4s} {'MB':>10s} {'MB/s':>10s} {'time(s)':>8s} {'peak RSS MB':>12s}")
+    for N_CHN in opts.chn:
+        root = f'{opts.root}_{N_CHN}C'
+        shutil.rmtree(root, ignore_errors=True)
+        files = make_survey(root, stations=opts.stations, dates=[date], hours=range(opts.hours),
+                            N_CHN=N_CHN, dt=opts.dt, gap_fraction=0.01, unlocked_fraction=0.01)
+        files_sn = sorted(glob.glob(f'{root}/{os.listdir(root)[0]}/*.BIN'))
+        headers = [read_bin(file, dt=opts.dt*1000)[2][0] for file in files]
+
+        args = dict(files=files, files_sn=files_sn, headers=headers, root=root, date=date,
+                    N_CHN=N_CHN, dt=opts.dt, out=opts.out)
+        size_all = sum(os.path.getsize(file) for file in files)
+        size_sn  = sum(os.path.getsize(file) for file in files_sn)
+
+        bench('read_bin',     args, size_all)
+        bench('bheader2list', args, sum(hs.nbytes for hs in headers))
+        bench('bins2sac',     args, size_sn)
+        bench('bins2h5',      args, size_sn)
+        bench('bins2h5_day',  args, size_all)
+
+        if not opts.keep:
+            shutil.rmtree(root)
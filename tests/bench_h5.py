@@ -0,0 +1,69 @@
+import sys
+import os
+import time
+import numpy as np
+import h5py
+sys.path.append('../src/')
+
+from pygdst.convert import h5_storage
+from pygdst.paras import COUNT2V
+
+# 比较不同h5存储方式的文件大小和读取速度
+# 模拟 bins2h5_day 的输出: data/{name} [N_CHN, nt]
+
+NS = 20            # 台站数
+N_CHN = 3
+dt = 0.01          # 降采后采样间隔, s
+HOURS = 2          # 为节省时间只模拟2小时
+nt = int(3600*HOURS/dt)
+out = './out/bench_h5.h5'
+os.makedirs('./out', exist_ok=True)
+
+rng = np.random.default_rng(0)
+def station_counts():
+    # 低幅值的有色噪声, 与实际的count取值范围相近
+    x = np.cumsum(rng.integers(-2**10, 2**10, size=[N_CHN, nt], dtype=np.int32), axis=1, dtype=np.int64)
+    x -= x.mean(axis=1, keepdims=True).astype(np.int64)
+    return x.astype(np.int32)
+
+stations = [station_counts() for i in range(NS)]
+
+layouts = [
+    ('contiguous float32',         False, {}),
+    ('chunk 60s float32',          False, dict(chunk_seconds=60)),
+    ('chunk 60s float32 gzip',     False, dict(chunk_seconds=60, shuffle=True, compression='gzip', compression_opts=4)),
+    ('chunk 60s float32 lzf',      False, dict(chunk_seconds=60, shuffle=True, compression='lzf')),
+    ('chunk 60s int32 count gzip', True,  dict(chunk_seconds=60, shuffle=True, compression='gzip', compression_opts=4)),
+    ('chunk 60s int32 count lzf',  True,  dict(chunk_seconds=60, shuffle=True, compression='lzf')),
+]
+
+print(f'{NS} stations x {N_CHN} chn x {nt} samples')
+print(f'{"layout":30s} {"size MB":>8s} {"write MB/s":>10s} {"station MB/s":>12s} {"1 min all stations ms":>22s}')
+for name, raw_counts, opts in layouts:
+    storage = h5_storage((N_CHN, nt), dt, **opts)
+    nbytes = 0
+
+    t = time.time()
+    with h5py.File(out, 'w') as f:
+        for i, counts in enumerate(stations):
+            data = counts if raw_counts else (counts*COUNT2V).astype(np.float32)
+            f.create_dataset(f'data/S{i:03d}', data=data, **storage)
+            nbytes += data.nbytes
+    t_write = time.time()-t
+    size = os.path.getsize(out)
+
+    with h5py.File(out, 'r') as f:
+        t = time.time()
+        for i in range(NS):
+            f[f'data/S{i:03d}'][:]
+        t_station = time.time()-t
+
+        sp = int(1800/dt)
+        t = time.time()
+        for i in range(NS):
+            f[f'data/S{i:03d}'][:, sp:sp+int(60/dt)]
+        t_minute = time.time()-t
+
+    print(f'{name:30s} {size/1e6:8.1f} {nbytes/1e6/t_write:10.1f} {nbytes/1e6/t_station:12.1f} {t_minute*1000:22.1f}')
+
+os.remove(out)
@@ -0,0 +1,47 @@
+import sys
+import subprocess
+
+# 导入时间测试: 每次在新的解释器中导入, 取多次运行的最小值
+# import pygdst; pygdst.read_bin 不应加载 obspy, scipy, h5py, matplotlib
+# eg: python bench_import.py --repeat 5
+
+HEAVY = ['obspy', 'scipy', 'h5py', 'matplotlib', 'tqdm']
+
+CASES = [
+    ('numpy',                        'import numpy'),
+    ('pygdst.read_bin',              'import pygdst; pygdst.read_bin'),
+    ('pygdst.decimate',              'import pygdst, numpy; pygdst.decimate(numpy.zeros(10), 2)'),
+    ('pygdst.bins2h5_day',           'import pygdst; pygdst.bins2h5_day; import h5py'),
+    ('pygdst.bins2sac',              'import pygdst; pygdst.bins2sac; import obspy'),
+]
+
+SCRIPT = '''
+import sys, time
+sys.path.insert(0, '../src/')
+t = time.perf_counter()
+{code}
+t = time.perf_counter()-t
+print(t, ','.join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def run(code):
+    out = subprocess.run([sys.executable, '-c', SCRIPT.format(code=code, heavy=HEAVY)],
+                         check=True, capture_output=True, text=True).stdout.split()
+    return float(out[0]), out[1] if len(out)>1 else ''
+
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    opts = parser.parse_args()
+
+    print(f"{'case':22s} {'ms':>8s}  loaded")
+    for name, code in CASES:
+        results = [run(code) for _ in range(opts.repeat)]
+        t = min(r[0] for r in results)
+        print(f'{name:22s} {t*1000:8.1f}  {results[0][1]}')
+
+    t, loaded = run('import pygdst; pygdst.read_bin')
+    assert loaded=='', f'import pygdst loads {loaded}'
@@ -0,0 +1,43 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pygdst import build_catalog, bins2h5_day
+from pygdst.catalog import catalog_select
+from pygdst.synth import make_survey, make_bin
+
+DT   = 0.01
+DATE = '240528'
+
+
+def test_catalog_rewritten_file(tmp_path):
+    # 原地改写的文件不改变台站文件夹的修改时间, 增量更新仍要发现, 续写时重新转换该台站
+    import h5py
+
+    root, index_file, h5_name = str(tmp_path/'root'), str(tmp_path/'catalog.npz'), str(tmp_path/'day.h5')
+    make_survey(root, stations=2, dates=[DATE], hours=range(2), N_CHN=1, dt=DT, seed=3)
+    catalog = build_catalog(root, index_file=index_file, dt=DT)
+    bins2h5_day(root, h5_name, DATE, header_file_pattern=None, dt=DT, catalog=catalog)
+    with h5py.File(h5_name, 'r') as f:
+        before = f['data/A0000001'][:]
+
+    file_name = f'{root}/A0000001/{DATE}00.BIN'
+    dir_mtime = os.stat(f'{root}/A0000001').st_mtime_ns
+    make_bin(file_name, date=DATE, hour=0, N_CHN=1, dt=DT, seed=99)
+    os.utime(file_name, ns=(dir_mtime+10**9, dir_mtime+10**9))
+    os.utime(f'{root}/A0000001', ns=(dir_mtime, dir_mtime))
+
+    catalog = build_catalog(root, index_file=index_file, dt=DT)
+    r = catalog_select(catalog, sn='A0000001', date=DATE)[0]
+    assert r['mtime']==os.stat(file_name).st_mtime
+
+    bins2h5_day(root, h5_name, DATE, header_file_pattern=None, dt=DT, catalog=catalog, mode='a')
+    with h5py.File(h5_name, 'r') as f:
+        assert not np.array_equal(f['data/A0000001'][:], before)
+
+    # dir_mtime=True 时只按文件夹修改时间判断, 沿用旧记录
+    os.utime(file_name, ns=(dir_mtime+2*10**9, dir_mtime+2*10**9))
+    os.utime(f'{root}/A0000001', ns=(dir_mtime, dir_mtime))
+    stale = build_catalog(root, index_file=index_file, dt=DT, dir_mtime=True)
+    assert catalog_select(stale, sn='A0000001', date=DATE)[0]['mtime']==r['mtime']
@@ -0,0 +1,125 @@
+import os
+import sys
+import glob
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pygdst import read_bin, bheader_decode, bheader_decode_all, block_health, bins2sac, bins2h5_day, decimate
+from pygdst.filters import decimation_zi
+from pygdst.paras import DATA_SIZE, CHN_DEF
+from pygdst.synth import make_survey
+
+# 优化后的实现与原始实现(逐块解码、单进程、obspy降采样、合并后降采样)结果一致
+# 在 make_survey 生成的模拟数据上比较; eg: python -m pytest tests
+
+DT   = 0.01
+DATE = '240528'
+
+
+@pytest.fixture(scope='module')
+def survey(tmp_path_factory):
+    # 2个台站3个小时, 第2个台站缺失01时, 含未采集和GPS未锁定的数据块
+    root = str(tmp_path_factory.mktemp('survey'))
+    make_survey(root, stations=2, dates=[DATE], hours=range(3), N_CHN=3, dt=DT,
+                gap_fraction=0.02, unlocked_fraction=0.02, seed=1)
+    os.remove(f'{root}/A0000002/{DATE}01.BIN')
+    return root
+
+
+def _h5_datasets(h5_name) -> dict:
+    import h5py
+    out = {}
+    with h5py.File(h5_name, 'r') as f:
+        f.visititems(lambda name, obj: out.__setitem__(name, obj[()]) if isinstance(obj, h5py.Dataset) else None)
+    return out
+
+
+def test_bheader_decode_all(survey):
+    _, _, hs = read_bin(f'{survey}/A0000001/{DATE}00.BIN', dt=DT*1000)
+    headers = hs[0]
+    # 随机的块头, 包括各字段的最高位
+    rng = np.random.default_rng(0)
+    headers = np.concatenate([headers, rng.integers(-2**31, 2**31, size=[64, headers.shape[1]], dtype=np.int32)])
+
+    columns = bheader_decode_all(headers)
+    expected = list(zip(*[bheader_decode(h) for h in headers]))
+    for column, column_expected in zip(columns, expected):
+        np.testing.assert_array_equal(column, np.array(column_expected))
+
+
+@pytest.mark.parametrize('raw_counts', [False, True])
+def test_bins2h5_day_workers(survey, tmp_path, raw_counts):
+    out = {}
+    for workers in (1, 2):
+        h5_name = str(tmp_path/f'day_{workers}.h5')
+        bins2h5_day(survey, h5_name, DATE, header_file_pattern=None, N_CHN=3, dt=DT,
+                    DOWNSAMPLE_RATE=5, raw_counts=raw_counts, workers=workers)
+        out[workers] = _h5_datasets(h5_name)
+
+    assert out[1].keys()==out[2].keys()
+    for name in out[1]:
+        np.testing.assert_array_equal(out[1][name], out[2][name], err_msg=name)
+
+
+@pytest.mark.parametrize('factor', [2, 5, 7])
+def test_decimate_obspy(factor):
+    from obspy import Trace
+
+    rng = np.random.default_rng(factor)
+    data = rng.standard_normal([3, 100003])
+    expected = []
+    for x in data:
+        trace = Trace(x.copy(), header={'delta': DT})
+        trace.decimate(factor)
+        expected.append(trace.data)
+
+    np.testing.assert_allclose(decimate(data, factor, dt=DT, chunk=4096), expected, rtol=0, atol=1e-10)
+
+    # 分段流式降采样, 各段长度不是factor的整数倍
+    zi, n, parts = decimation_zi(data.shape, factor, DT), 0, []
+    for ep in (12345, 50000, 77777, data.shape[-1]):
+        y, zi = decimate(data[:, n:ep], factor, dt=DT, zi=zi, phase=-n%factor)
+        parts.append(y)
+        n = ep
+    np.testing.assert_allclose(np.concatenate(parts, axis=-1), expected, rtol=0, atol=1e-10)
+
+
+def _merge_decimate(files, factor) -> list:
+    # 原始的转换方式: 逐小时读取并置零不健康的数据块, 合并(缺失补0)后用obspy降采样
+    from obspy import Stream, Trace, UTCDateTime
+
+    streams = None
+    for file in files:
+        _, data, hs = read_bin(file, dt=DT*1000, IS_Z_CHN=False)
+        t_s = os.path.basename(file)[0:8]
+        health = block_health(hs, dt=DT*1000, date=int(t_s[:6]))
+        data = data.copy()
+        data.reshape([data.shape[0], -1, DATA_SIZE])[~health] = 0
+        t = UTCDateTime(int(t_s[0:2])+2000, int(t_s[2:4]), int(t_s[4:6]), int(t_s[6:8]))
+        traces = [Trace(x, header={'delta': DT, 'starttime': t}) for x in data]
+        streams = [Stream([trace]) for trace in traces] if streams is None else \
+                  [stream+trace for stream, trace in zip(streams, traces)]
+
+    out = []
+    for stream in streams:
+        stream.merge(fill_value=0)
+        stream.decimate(factor)
+        out.append(stream[0])
+    return out
+
+
+@pytest.mark.parametrize('factor', [5, 7])
+def test_bins2sac_stream(survey, tmp_path, factor):
+    from obspy import read
+
+    files = sorted(glob.glob(f'{survey}/A0000002/*.BIN'))
+    expected = _merge_decimate(files, factor)
+
+    bins2sac(files, str(tmp_path/'A2.{CHN}.sac'), dt=DT, name='A2', N_CHN=3, DOWNSAMPLE_RATE=factor)
+    for trace_expected, chn in zip(expected, CHN_DEF[3]):
+        trace = read(str(tmp_path/f'A2.{chn}.sac'))[0]
+        assert trace.stats.starttime==trace_expected.stats.starttime
+        assert trace.stats.delta==pytest.approx(trace_expected.stats.delta)
+        atol = 1e-6*np.abs(trace_expected.data).max()
+        np.testing.assert_allclose(trace.data, trace_expected.data, rtol=0, atol=atol)
@@ -0,0 +1,82 @@
+import os
+import sys
+import glob
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from pygdst import read_bin, block_health, read_array_window, read_h5_array_window, bins2h5_day
+from pygdst.paras import DATA_SIZE
+from pygdst.synth import make_survey
+
+DT   = 0.01
+DATE = '240528'
+
+
+@pytest.fixture(scope='module')
+def survey(tmp_path_factory):
+    # 2个台站2个小时, 含未采集的数据块
+    root = str(tmp_path_factory.mktemp('survey'))
+    make_survey(root, stations=2, dates=[DATE], hours=range(2), N_CHN=3, dt=DT, gap_fraction=0.02, seed=2)
+    return root
+
+
+def _file_health(station_dir) -> np.array:
+    # 逐文件计算的健康度, 按时间拼接
+    health = []
+    for file in sorted(glob.glob(f'{station_dir}/*.BIN')):
+        _, _, hs = read_bin(file, dt=DT*1000)
+        health.append(block_health(hs, dt=DT*1000, date=int(DATE)).all(axis=0))
+    return np.concatenate(health)
+
+
+@pytest.mark.parametrize('t0, t1', [('2024-05-28T00:10:00', '2024-05-28T00:11:00'),
+                                    ('2024-05-28T00:59:30', '2024-05-28T01:00:30'),
+                                    ('2024-05-28T00:00:00', '2024-05-28T02:00:00')])
+def test_read_array_window_health(survey, t0, t1):
+    station_dirs = sorted(glob.glob(f'{survey}/A*'))
+    arr, meta = read_array_window(station_dirs, np.datetime64(t0), np.datetime64(t1), dt=DT*1000)
+    try:
+        T_BLOCK = np.timedelta64(int(DATA_SIZE*DT*1e6), 'us')
+        b0 = int((meta['block_times'][0]-np.datetime64(f'20{DATE[:2]}-{DATE[2:4]}-{DATE[4:6]}', 'us'))//T_BLOCK)
+        for i, station_dir in enumerate(station_dirs):
+            expected = _file_health(station_dir)[b0:b0+len(meta['block_times'])]
+            np.testing.assert_array_equal(meta['health'][i], expected)
+    finally:
+        arr.close()
+        arr.unlink()
+
+
+def test_read_array_window_error_unlinks(survey, tmp_path):
+    # 第二个台站的文件被截断, 读取出错后共享内存不留在 /dev/shm
+    broken = tmp_path/'A9999999'
+    broken.mkdir()
+    with open(f'{survey}/A0000001/{DATE}00.BIN', 'rb') as f:
+        (broken/f'{DATE}00.BIN').write_bytes(f.read(2**20))
+    station_dirs = [f'{survey}/A0000001', str(broken)]
+
+    before = set(os.listdir('/dev/shm'))
+    with pytest.raises((IndexError, ValueError)):
+        read_array_window(station_dirs, np.datetime64('2024-05-28T00:50:00'), np.datetime64('2024-05-28T00:51:00'),
+                          dt=DT*1000)
+    assert set(os.listdir('/dev/shm'))<=before
+
+
+def test_read_h5_array_window_without_date(survey, tmp_path):
+    # user-018 之前的 bins2h5_day 输出没有date, 由文件名中的日期得到
+    import h5py
+
+    h5_name = str(tmp_path/f'day_{DATE}.h5')
+    bins2h5_day(survey, h5_name, DATE, header_file_pattern=None, N_CHN=3, dt=DT, DOWNSAMPLE_RATE=5)
+    t0, t1 = np.datetime64('2024-05-28T00:59:30'), np.datetime64('2024-05-28T01:00:30')
+    arr, meta = read_h5_array_window(h5_name, t0, t1)
+    with h5py.File(h5_name, 'a') as f:
+        del f['date']
+    arr_old, meta_old = read_h5_array_window(h5_name, t0, t1)
+    try:
+        np.testing.assert_array_equal(arr_old.data, arr.data)
+        assert meta_old['t_first']==meta['t_first']
+    finally:
+        for a in (arr, arr_old):
+            a.close()
+            a.unlink()